@@ -0,0 +1,280 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import base64
+import json
+import dateutil.parser
+from datetime import datetime
+from flask import Blueprint, request, current_app, make_response
+from flask_restful import Api, Resource, abort
+from model import db, load_fields_of, ShowConflictError, Venue, Artist, Show,\
+                  VENUE_COLUMNS, ARTIST_COLUMNS, RELATION_FIELDS
+from facets import get_filters, get_facet_counts
+from schedule import expand_recurrence, parse_start_time, parse_start_times, get_show_page_keys
+from cache import response_cache
+from constants import DEFAULT_SHOW_DURATION
+
+#----------------------------------------------------------------------------#
+# API Config.
+#----------------------------------------------------------------------------#
+
+api_blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+api = Api(api_blueprint)
+
+
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+  """
+  Serializes responses as JSON, with the native datetimes of the model as ISO 8601 strings
+  """
+  response = make_response(json.dumps(data, default=to_json) + '\n', code)
+  response.headers.extend(headers or {})
+  return response
+
+
+def to_json(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  raise TypeError('{!r} is not JSON serializable'.format(value))
+
+# fields of a show, named like the keys of get_show_dict. Venue and artist are joined only when needed
+SHOW_COLUMNS = {
+  'venue_id': Show.venue_id,
+  'venue_name': Venue.name,
+  'artist_id': Show.artist_id,
+  'artist_name': Artist.name,
+  'artist_image_link': Artist.image_link,
+  'start_time': Show.start_time,
+  'duration': Show.duration
+}
+
+# fields returned when the request has no fields parameter
+DEFAULT_LIST_FIELDS = ('id', 'name')
+
+#----------------------------------------------------------------------------#
+# Request parsing.
+#----------------------------------------------------------------------------#
+
+def get_fields(allowed, default):
+  """
+  Parses the comma separated fields parameter
+
+  Parameters:
+    allowed (iterable): field names the resource supports
+    default (iterable): fields returned when the parameter is missing
+
+  Returns:
+    fields (list): requested fields in the order given
+  """
+  if 'fields' not in request.args:
+    return list(default)
+  fields = list(dict.fromkeys(field.strip() for field in request.args['fields'].split(',') if field.strip()))
+  unknown = [field for field in fields if field not in allowed]
+  if unknown or not fields:
+    abort(400, message='Unknown fields: {}. Supported fields: {}'.format(', '.join(unknown), ', '.join(allowed)))
+  return fields
+
+
+def get_limit():
+  """
+  Parses the page size, defaults to API_PAGE_SIZE and is capped at API_MAX_PAGE_SIZE
+  """
+  try:
+    limit = int(request.args.get('limit', current_app.config['API_PAGE_SIZE']))
+  except ValueError:
+    abort(400, message='limit must be an integer')
+  return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def encode_cursor(values):
+  """
+  Turns the sort key of the last row of a page into an opaque cursor
+  """
+  return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(types):
+  """
+  Reads the cursor parameter back into the sort key it was made from, None on the first page
+
+  Parameters:
+    types (tuple): type of each value of the sort key, e.g. (str, int, int)
+
+  Returns:
+    cursor (list): values of the sort key, checked against types
+
+  Raises:
+    HTTPException: 400 when the cursor is not a sort key of these types
+  """
+  cursor = request.args.get('cursor')
+  if not cursor:
+    return None
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+  except ValueError:
+    abort(400, message='Invalid cursor')
+  # JSON true and false are ints to isinstance
+  if not (isinstance(values, list) and len(values) == len(types) and\
+          all(isinstance(value, value_type) and not isinstance(value, bool) for value, value_type in zip(values, types))):
+    abort(400, message='Invalid cursor')
+  return values
+
+
+def get_int_arg(name):
+  """
+  Parses an optional integer filter, None when it is missing
+  """
+  value = request.args.get(name)
+  if value is None:
+    return None
+  try:
+    return int(value)
+  except ValueError:
+    abort(400, message='{} must be an integer'.format(name))
+
+def list_entities(model, columns):
+  """
+  Serves a page of venues or artists, ordered by id and paginated with a keyset cursor, optionally
+  filtered by genre, state and seeking
+  """
+  fields = get_fields(list(columns) + list(RELATION_FIELDS), DEFAULT_LIST_FIELDS)
+  limit = get_limit()
+  cursor = decode_cursor((int,))
+  query_filter = model.id > cursor[0] if cursor else db.true()
+  # one extra row tells whether there is a next page
+  records = load_fields_of(model, fields, query_filter, limit + 1, get_filters(request.args))
+  next_cursor = encode_cursor([records[limit - 1]['id']]) if len(records) > limit else None
+  return {'data': records[:limit], 'next_cursor': next_cursor}
+
+
+def get_entity(model, columns, entity_id):
+  """
+  Serves one venue or artist, with every field of format_all unless fields is given
+  """
+  fields = get_fields(list(columns) + list(RELATION_FIELDS), list(columns) + list(RELATION_FIELDS))
+  record = model.load_fields(entity_id, fields)
+  if record is None:
+    abort(404, message='{} {} not found'.format(model.__tablename__, entity_id))
+  return {'data': record}
+
+#----------------------------------------------------------------------------#
+# Resources.
+#----------------------------------------------------------------------------#
+
+class VenueList(Resource):
+    def get(self):
+      return list_entities(Venue, VENUE_COLUMNS)
+
+
+class VenueFacets(Resource):
+    def get(self):
+      return {'data': get_facet_counts(Venue)}
+
+
+class VenueDetail(Resource):
+    def get(self, venue_id):
+      return get_entity(Venue, VENUE_COLUMNS, venue_id)
+
+
+class ArtistList(Resource):
+    def get(self):
+      return list_entities(Artist, ARTIST_COLUMNS)
+
+
+class ArtistFacets(Resource):
+    def get(self):
+      return {'data': get_facet_counts(Artist)}
+
+
+class ArtistDetail(Resource):
+    def get(self, artist_id):
+      return get_entity(Artist, ARTIST_COLUMNS, artist_id)
+
+
+class ShowList(Resource):
+    def get(self):
+      """
+      Serves a page of shows ordered by start time, optionally of one venue or artist. Venue and
+      artist are only joined when one of their fields is requested
+      """
+      fields = get_fields(list(SHOW_COLUMNS), list(SHOW_COLUMNS))
+      limit = get_limit()
+      cursor = decode_cursor((str, int, int))
+      sort_key = [Show.start_time, Show.venue_id, Show.artist_id]
+      selected = [SHOW_COLUMNS[field].label(field) for field in fields if field not in ('venue_id', 'artist_id', 'start_time')]
+      query = db.session.query(*(sort_key + selected))
+      if any(field == 'venue_name' for field in fields):
+        query = query.join(Venue, Venue.id == Show.venue_id)
+      if any(field.startswith('artist_') and field != 'artist_id' for field in fields):
+        query = query.join(Artist, Artist.id == Show.artist_id)
+      for name, column in (('venue_id', Show.venue_id), ('artist_id', Show.artist_id)):
+        value = get_int_arg(name)
+        if value is not None:
+          query = query.filter(column == value)
+      if cursor:
+        try:
+          start_time = dateutil.parser.parse(cursor[0])
+        except (ValueError, OverflowError):
+          abort(400, message='Invalid cursor')
+        query = query.filter(db.tuple_(*sort_key) > db.tuple_(start_time, cursor[1], cursor[2]))
+      rows = query.order_by(*sort_key).limit(limit + 1).all()
+      records = []
+      for row in rows[:limit]:
+        show = row._asdict()
+        show['start_time'] = show['start_time'].isoformat()
+        records.append({field: show[field] for field in fields})
+      next_cursor = None
+      if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor([last.start_time.isoformat(), last.venue_id, last.artist_id])
+      return {'data': records, 'next_cursor': next_cursor}
+
+
+class ShowBatch(Resource):
+    def post(self):
+      """
+      Creates the shows of one venue and artist with one multi-row insert. The body gives either
+      start_times, a list of ISO 8601 times, or a recurrence: start, frequency ('daily', 'weekly'
+      or 'monthly'), interval and count or until. duration is in minutes. Shows that already exist
+      are reported as duplicates, shows overlapping others at the venue fail the whole batch with 409
+      """
+      body = request.get_json(silent=True)
+      if not isinstance(body, dict):
+        abort(400, message='Expected a JSON object')
+      max_occurrences = current_app.config['SHOW_BATCH_MAX_OCCURRENCES']
+      try:
+        venue_id, artist_id = int(body['venue_id']), int(body['artist_id'])
+        if 'start_times' in body:
+          if not isinstance(body['start_times'], list):
+            raise ValueError('start_times must be a list')
+          start_times = parse_start_times(body['start_times'], max_occurrences)
+        else:
+          until = parse_start_time(body['until']) if body.get('until') else None
+          start_times = expand_recurrence(parse_start_time(body['start']), body.get('frequency'),\
+                                          int(body.get('interval', 1)), body.get('count'), until,\
+                                          max_occurrences)
+        result = Show.create_batch(venue_id, artist_id, start_times, body.get('duration', DEFAULT_SHOW_DURATION))
+      except KeyError as e:
+        abort(400, message='Missing field {}'.format(e))
+      except ShowConflictError as e:
+        abort(409, message=str(e), conflicts=[{'start_time': start_time.isoformat(),\
+                                               'artist_id': other_artist_id,\
+                                               'conflicting_start_time': other_start_time.isoformat()}\
+                                              for (artist_id, start_time), (other_artist_id, other_start_time) in e.conflicts])
+      except (ValueError, TypeError, OverflowError) as e:
+        abort(400, message=str(e))
+      if result['created']:
+        response_cache.invalidate(*get_show_page_keys(venue_id, artist_id))
+      return {'data': {key: [start_time.isoformat() for start_time in start_times]\
+                       for key, start_times in result.items()}}, 201
+
+
+api.add_resource(VenueList, '/venues')
+api.add_resource(VenueFacets, '/venues/facets')
+api.add_resource(VenueDetail, '/venues/<int:venue_id>')
+api.add_resource(ArtistList, '/artists')
+api.add_resource(ArtistFacets, '/artists/facets')
+api.add_resource(ArtistDetail, '/artists/<int:artist_id>')
+api.add_resource(ShowList, '/shows')
+api.add_resource(ShowBatch, '/shows/batch')
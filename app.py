@@ -6,8 +6,9 @@ import sys
 import json
 import dateutil.parser
 import babel
+import babel.dates
 from flask import Flask, render_template, request, Response, flash,\
-                  redirect, url_for, abort, make_response
+                  redirect, url_for, abort, make_response, jsonify, session, stream_with_context, g
 from flask_cors import CORS
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
@@ -15,12 +16,25 @@ import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
+from schedule import expand_recurrence, parse_start_time, parse_start_times, get_show_page_keys
 import config
 from flask_migrate import Migrate
 from datetime import datetime
 import traceback
-from model import setup_db, db, Venue, Show, Artist, VenueGenre, ArtistGenre
-from constants import FUTURE, PAST
+import hashlib
+from functools import wraps, lru_cache
+from itertools import chain
+from model import setup_db, db, entity_cache, sync_genres, ShowConflictError, Venue, Show, Artist, VenueGenre, ArtistGenre, TableVersion
+from commands import register_commands
+import search
+import exporter
+import facets
+from api import api_blueprint
+from text_index import index_name, unindex_name
+from cache import response_cache
+from db_pool import get_pool_stats
+from db_routing import setup_routing, replica_reads, in_write_window
+from constants import FUTURE, PAST, DEFAULT_SHOW_DURATION, DATETIME_FORMATS
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -32,21 +46,51 @@ CORS(app)
 app.config.from_object('config')
 setup_db(app)
 
+# reads of GET requests go to the replicas, if any are configured
+setup_routing(app)
+
 # flask migrate
 migrate = Migrate(app, db)
 
+# flask cli commands
+register_commands(app)
+
+# JSON API under /api/v1
+app.register_blueprint(api_blueprint)
+
+# rendered pages of the listing and detail routes
+response_cache.max_entries = app.config['RESPONSE_CACHE_SIZE']
+response_cache.ttl = app.config['RESPONSE_CACHE_TTL']
+
+# fields of the edit forms, loaded without the shows, see Venue.load_fields
+EDIT_VENUE_FIELDS = ['name', 'genres', 'address', 'city', 'state', 'phone', 'website', 'facebook_link',\
+                     'seeking_talent', 'seeking_description', 'image_link']
+EDIT_ARTIST_FIELDS = ['name', 'genres', 'city', 'state', 'phone', 'website', 'facebook_link',\
+                      'seeking_venue', 'seeking_description', 'image_link']
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  # "start_time": "2019-05-21T21:30:00.000Z"
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+@lru_cache(maxsize=64)
+def get_datetime_formatter(format, locale):
+  """
+  Compiles a datetime pattern and resolves the locale once per (format, locale), work that
+  babel.dates.format_datetime repeats on every call
+
+  Returns:
+    formatter (tuple): (DateTimePattern, Locale) to format datetimes with
+  """
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+  # show dictionaries and listing rows carry native datetimes, strings are parsed for other callers
+  date = value if isinstance(value, datetime) else dateutil.parser.parse(value)
+  pattern, locale = get_datetime_formatter(format, locale)
+  if date.tzinfo is None:
+    # what babel.dates.format_datetime does with naive datetimes, which it formats in UTC
+    date = date.replace(tzinfo=babel.dates.UTC)
+  return pattern.apply(date, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -55,59 +99,143 @@ app.jinja_env.filters['datetime'] = format_datetime
 # Utils.
 #----------------------------------------------------------------------------#
 
-def get_venues(venues_raw):
+def get_venues(venue_rows):
   """
-  Groups the venues by city,state as required by the venues page
+  Groups the venues by city,state as required by the venues page. Areas are generated one at a
+  time, so that a streamed page sends each area as soon as its rows are read
 
   Parameters:
-    venues_raw (list): list of venue objects to be transformed
+    venue_rows (iterable): (city, state, id, name, num_upcoming_shows) rows ordered by city and state,
+                           as returned by Venue.get_area_rows
   
   Returns:
-    venues (list): Appropriately formatted venues, grouped by city and state
+    venues (generator): Appropriately formatted venues, grouped by city and state
   """
-  venues = []
   try:
-    #get distinct cities 
-    distinct_cities = set([(venue.city, venue.state) for venue in venues_raw])
-    #prepare data
-    for city,state in distinct_cities:
-      venue_dict = {'city':city, 'state': state, 'venues':[]}
-      venues_in_city = [{'id': venue.id,\
-                         'name': venue.name,\
-                         'num_upcoming_shows': len(venue.get_shows(FUTURE))}\
-                         for venue in venues_raw\
-                         if venue.city==city and venue.state==state]
-      venue_dict['venues'] = venues_in_city
-      venues.append(venue_dict)
+    area = None
+    # rows arrive sorted by (city, state), so a new area starts whenever the pair changes
+    for city, state, venue_id, name, num_upcoming_shows in venue_rows:
+      if area is None or area['city'] != city or area['state'] != state:
+        if area is not None:
+          yield area
+        area = {'city': city, 'state': state, 'venues': []}
+      area['venues'].append({'id': venue_id,\
+                             'name': name,\
+                             'num_upcoming_shows': num_upcoming_shows})
+    if area is not None:
+      yield area
   except Exception as e:
     raise e
-  return venues
 
 def get_artists(artists_raw):
   """
-  Formats the artists as required by the get artists endpoint
+  Formats the artists as required by the get artists endpoint, one at a time so that a streamed
+  page sends each as soon as it is read
 
   Parameters:
-    artists_raw (list): list of artist objects to be transformed
+    artists_raw (iterable): list of artist objects to be transformed
   
   Returns:
-    artists (list): Appropriately formatted artists
+    artists (generator): Appropriately formatted artists
   """
-  artists = []
   try:
     for artist in artists_raw:
-      artists.append({
+      yield {
         'id': artist.id,
         'name': artist.name
-      })
+      }
   except Exception as e:
     raise e
-  return artists
 
+def peek_rows(rows):
+  """
+  Reads the first row of a listing, so that an empty one can still be answered with 404 before
+  a streamed page has started
+
+  Parameters:
+    rows (iterable): rows of the listing, possibly read lazily
+
+  Returns:
+    rows (iterator): the same rows, None if there are none
+  """
+  rows = iter(rows)
+  first = next(rows, None)
+  if first is None:
+    return None
+  return chain([first], rows)
+
+def get_form_datetime(field):
+  """
+  Reads a date and time field with parse_start_time, which accepts the advertised YYYY-MM-DD HH:MM
+  as well as seconds or a UTC offset, where the field itself only accepts its one format
+
+  Parameters:
+    field (DateTimeField): submitted field
+
+  Returns:
+    value (datetime): the date and time, None when the field is empty
+
+  Raises:
+    ValueError: if the field holds something else than a date and time
+  """
+  value = ' '.join(field.raw_data or []).strip()
+  if not value:
+    return None
+  try:
+    return parse_start_time(value)
+  except (ValueError, OverflowError):
+    raise ValueError('Invalid {} {!r}'.format(field.name.replace('_', ' '), value))
+
+def get_listing_batch_size():
+  """
+  Gets the number of rows read at a time by the listing pages, None to load them at once when
+  the pages are not streamed
+  """
+  return app.config['LISTING_BATCH_SIZE'] if app.config['STREAM_LISTINGS'] else None
+
+def render_listing(template_name, **context):
+  """
+  Renders a listing page. With STREAM_LISTINGS the template is generated piece by piece while the
+  rows are read: the layout and the first tiles are sent before the last row is fetched, and the
+  request context, with its database session, stays open until the page is sent
+
+  Pages carrying flashed messages are rendered whole, since the session cookie goes out with the
+  headers, before the layout pops the messages from the session
+
+  Parameters:
+    template_name (str): template of the page
+    context: template variables, the rows may be generators
+
+  Returns:
+    page (str|Response): the rendered page or a streamed response
+  """
+  if not app.config['STREAM_LISTINGS'] or '_flashes' in session:
+    return render_template(template_name, **context)
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  # join the small pieces jinja yields into fewer, larger writes
+  stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+  return Response(stream_with_context(stream))
+
+def cache_stream(cache_key, chunks, version=None):
+  """
+  Passes the chunks of a streamed page through and stores the whole page in response_cache once
+  the last one is sent. A stream cut short, e.g. by a client going away, is not cached
+  """
+  sent = []
+  try:
+    for chunk in chunks:
+      sent.append(chunk)
+      yield chunk
+    response_cache.set(cache_key, ''.join(sent), version=version)
+  finally:
+    if hasattr(chunks, 'close'):
+      chunks.close()
 
 def update_genres_venue(new_genres, venue):
   """
-  Updates genres for a venue with a new set of genres. Replaces the old genres with new 
+  Updates genres for a venue with a new set of genres. Replaces the old genres with new, with one
+  DELETE and one INSERT whatever the number of genres, see model.sync_genres
 
   Parameters:
     new_genres (list): List of new genres
@@ -115,27 +243,14 @@ def update_genres_venue(new_genres, venue):
 
   """
   try:
-    common_genres = []    # common between edit form and existing records  
-    
-    # step 1: delete 
-    for genre in venue.genres:
-      if genre.name in new_genres:
-        common_genres.append(genre.name)
-      else:
-        db.session.delete(genre)
-
-    # step 2: add new
-    new_uncommon_genres = list(set(new_genres) - set(common_genres))
-    for genre in new_uncommon_genres:
-      vg = VenueGenre(venue_id=venue.id, name=genre)
-      db.session.add(vg)
-
+    sync_genres(Venue, venue.id, new_genres)
   except Exception as e:
     raise e
 
 def update_genres_artist(new_genres, artist):
   """
-  Updates genres for an artist with a new set of genres. Replaces the old genres with new 
+  Updates genres for an artist with a new set of genres. Replaces the old genres with new, with one
+  DELETE and one INSERT whatever the number of genres, see model.sync_genres
 
   Parameters:
     new_genres (list): List of new genres
@@ -143,23 +258,118 @@ def update_genres_artist(new_genres, artist):
 
   """
   try:
-    common_genres = []    # common between edit form and existing records  
-    
-    # step 1: delete 
-    for genre in artist.genres:
-      if genre.name in new_genres:
-        common_genres.append(genre.name)
+    sync_genres(Artist, artist.id, new_genres)
+  except Exception as e:
+    raise e
+
+def cached_page(key):
+  """
+  Caches the page rendered by a GET view in response_cache
+
+  Pages are neither read from nor written to the cache while flashed messages are pending,
+  since the layout renders them into the page, nor when the request has query parameters such
+  as the listing filters, since invalidation only knows the unfiltered key.
+
+  Under conditional_page, pages are cached with the version its ETag is made from and only
+  served for that version, so a page cached before a change, by this worker or from a lagging
+  replica, is never sent under the ETag of the changed data. Requests in the user's write window
+  render from the primary and refresh the cache rather than read it, see in_write_window.
+
+  Parameters:
+    key (str): cache key, formatted with the view arguments e.g. 'venue:{venue_id}'
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(**kwargs):
+      if '_flashes' in session or request.args:
+        return view(**kwargs)
+      cache_key = key.format(**kwargs)
+      version = g.get('page_version')
+      page = None if in_write_window() else response_cache.get(cache_key, version)
+      if page is None:
+        page = view(**kwargs)
+        if isinstance(page, Response) and page.is_streamed:
+          page.response = cache_stream(cache_key, page.response, version)
+        else:
+          response_cache.set(cache_key, page, version=version)
+      return page
+    return wrapper
+  return decorator
+
+def conditional_page(get_version):
+  """
+  Answers conditional GET requests with 304 Not Modified when the page has not changed, without
+  running the view. Other responses get an ETag and a Last-Modified header. The version is left
+  in g.page_version for the caches the view reads from, which must not serve an older body
+
+  Parameters:
+    get_version (function): called with the view arguments, returns a tuple of the values the page
+                            depends on starting with its last modification time in UTC, or None
+                            to run the view unconditionally
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(**kwargs):
+      # pages carrying flashed messages are never reused
+      version = None if '_flashes' in session else get_version(**kwargs)
+      if version is None:
+        return view(**kwargs)
+      g.page_version = version
+      etag = hashlib.sha1(repr(version).encode()).hexdigest()
+      last_modified = version[0].replace(microsecond=0)
+      if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
       else:
-        db.session.delete(genre)
+        not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+      response = Response(status=304) if not_modified else make_response(view(**kwargs))
+      response.set_etag(etag)
+      response.last_modified = last_modified
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator
 
-    # step 2: add new
-    new_uncommon_genres = list(set(new_genres) - set(common_genres))
-    for genre in new_uncommon_genres:
-      ag = ArtistGenre(artist_id=artist.id, name=genre)
-      db.session.add(ag)
+def get_listing_version(*tables):
+  """
+  Builds the version of a listing page from the versions of the tables it renders
+  """
+  versions = TableVersion.get_versions(tables)
+  if not versions:
+    return None
+  return (max(updated_at for name, version, updated_at in versions),) + tuple(versions)
 
-  except Exception as e:
-    raise e
+def get_entity_version(model, entity_id):
+  """
+  Builds the version of a venue or artist page, see Venue.get_version. The page also changes when
+  a show moves from upcoming to past, so that moment counts as a modification
+  """
+  version = model.get_version(entity_id)
+  if version is None:
+    return None
+  updated_at, last_show_time = version
+  last_modified = updated_at
+  if last_show_time is not None:
+    # start times are stored in local time, updated_at in UTC
+    last_modified = max(updated_at, datetime.utcfromtimestamp(last_show_time.timestamp()))
+  return (last_modified, model.__tablename__, entity_id, updated_at, last_show_time)
+
+def get_venue_page_keys(venue_id):
+  """
+  Gets the cache keys of the pages showing a venue: its own page, the listings and the pages
+  of the artists playing there. Must be called before a delete, while the shows still exist
+  """
+  artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+  return ['venues', 'shows', 'venue:{}'.format(venue_id)] +\
+         ['artist:{}'.format(artist_id) for artist_id, in artist_ids]
+
+def get_artist_page_keys(artist_id):
+  """
+  Gets the cache keys of the pages showing an artist: its own page, the listings and the pages
+  of the venues it plays at
+  """
+  venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+  return ['artists', 'shows', 'artist:{}'.format(artist_id)] +\
+         ['venue:{}'.format(venue_id) for venue_id, in venue_ids]
 
 
 
@@ -176,14 +386,17 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@conditional_page(lambda: get_listing_version('venue'))
+@cached_page('venues')
 def venues():
   """
   Get venues data
   """
   try:
-    result = Venue.query.all()
+    filters = facets.get_filters(request.args)
+    result = Venue.get_area_rows(filters=filters, batch_size=get_listing_batch_size())
     data = get_venues(result)
-    return render_template('pages/venues.html', areas=data);
+    return render_listing('pages/venues.html', areas=data, filters=filters, facets=facets.get_facet_counts(Venue, g.get('page_version'), not in_write_window()));
   except Exception as e:
     print("Error occurred while fetching venues: ",e)
     print(traceback.format_exc())
@@ -191,27 +404,14 @@ def venues():
     
 
 @app.route('/venues/search', methods=['POST'])
+@replica_reads
 def search_venues():
   """
   Implement case-insensitive search on artists with partial string search.  
   """
   try:
     search_term = request.form.get('search_term', '')
-    results = Venue.query.order_by(Venue.id).filter(Venue.name.ilike('%{}%'.format(search_term))).all()
-    match_count = len(results)
-    if match_count == 0:
-      response = {
-        "count": match_count,
-        "data": []
-      }
-    else:
-      response = {
-        "count": len(results),
-        "data": [{"id":venue.id,\
-                  "name": venue.name,\
-                  "num_upcoming_shows": len(venue.get_shows(FUTURE))}\
-                  for venue in results]
-      }
+    response = search.search_venues(search_term)
     return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
   except Exception as e:
     print("Error occurred while seraching for venues: ",e)
@@ -220,17 +420,18 @@ def search_venues():
   
 
 @app.route('/venues/<int:venue_id>')
+@conditional_page(lambda venue_id: get_entity_version(Venue, venue_id))
+@cached_page('venue:{venue_id}')
 def show_venue(venue_id):
   """
   shows the venue page with the given venue_id
   """
   
   try:
-    result = Venue.query.filter_by(id=venue_id).all()
-    if len(result) == 0 :
+    data = Venue.get_formatted(venue_id, g.get('page_version'), cached=not in_write_window())
+    if data is None:
       print("No result for found for venue id {}".format(venue_id))
       abort(404)
-    data = result[0].format_all()
   except Exception as e:
     print("Error occured while fetching data for venue ", e)
     print(traceback.format_exc())
@@ -265,6 +466,7 @@ def create_venue_submission():
                   website_link=venue_dict['website_link'], image_link=venue_dict['image_link'],\
                   seeking_talent=seeking_talent, seeking_description=venue_dict['seeking_description'])
     venue.create(genres)
+    response_cache.invalidate('venues')
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   except Exception as e:
     print("Error while creating new venue: ", e)
@@ -281,8 +483,11 @@ def delete_venue(venue_id):
   # TODO: Implement Delete Button on UI
   try:
     venue = Venue.query.get(venue_id)
+    page_keys = get_venue_page_keys(venue.id)
     db.session.delete(venue)
     db.session.commit()
+    response_cache.invalidate(*page_keys)
+    unindex_name('venue', venue.id)
     flash('Deleted venue '+venue.name+' successfully!')
     return render_template('pages/home.html')
   except Exception as e:
@@ -297,17 +502,20 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional_page(lambda: get_listing_version('artist'))
+@cached_page('artists')
 def artists():
   """
   Get artists
   """
   try:
-    result = Artist.query.with_entities(Artist.id,Artist.name).all()
-    if len(result) == 0:
+    filters = facets.get_filters(request.args)
+    result = peek_rows(Artist.get_rows(filters, get_listing_batch_size()))
+    if result is None and not filters:
       print("No results found")
       abort(404)
-    data = get_artists(result)
-    return render_template('pages/artists.html', artists=data)
+    data = get_artists(result or [])
+    return render_listing('pages/artists.html', artists=data, filters=filters, facets=facets.get_facet_counts(Artist, g.get('page_version'), not in_write_window()))
   except Exception as e:
     print("Error occured while fetching artists", e)
     print(traceback.format_exc())
@@ -315,27 +523,14 @@ def artists():
   
 
 @app.route('/artists/search', methods=['POST'])
+@replica_reads
 def search_artists():
   """
   Implements case insesitive search on artists with partial string search
   """
   try:
     search_term = request.form.get('search_term', '')
-    results = Artist.query.order_by(Artist.id).filter(Artist.name.ilike('%{}%'.format(search_term))).all()
-    match_count = len(results)
-    if match_count == 0:
-      response = {
-        "count": match_count,
-        "data": []
-      }
-    else:
-      response = {
-        "count": len(results),
-        "data": [{"id":artist.id,\
-                  "name": artist.name,\
-                  "num_upcoming_shows": len(artist.get_shows(FUTURE))}\
-                  for artist in results]
-      }
+    response = search.search_artists(search_term)
     return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
   except Exception as e:
     print("Error occurred while seraching for artists: ",e)
@@ -343,14 +538,15 @@ def search_artists():
     abort(500)
 
 @app.route('/artists/<int:artist_id>')
+@conditional_page(lambda artist_id: get_entity_version(Artist, artist_id))
+@cached_page('artist:{artist_id}')
 def show_artist(artist_id):
   """shows the venue page with the given venue_id"""
   try:
-    result = Artist.query.filter_by(id=artist_id).all()
-    if len(result) == 0:
+    data = Artist.get_formatted(artist_id, g.get('page_version'), cached=not in_write_window())
+    if data is None:
       print("No result for found for artist id {}".format(artist_id))
       abort(404) 
-    data = result[0].format_all()
     return render_template('pages/show_artist.html', artist=data)
   except Exception as e:
     print("Error occured while fetching artist", e)
@@ -367,24 +563,10 @@ def edit_artist(artist_id):
   """
   form = ArtistForm()
   try:
-    result = Artist.query.filter_by(id=artist_id).all()
-    if len(result) == 0 :
+    artist = Artist.load_fields(artist_id, EDIT_ARTIST_FIELDS)
+    if artist is None:
       print("No result for found for artist id {}".format(artist_id))
       abort(404)
-    data = result[0].format_all()
-    artist = {
-      "id": data["id"],
-      "name": data["name"],
-      "genres": data["genres"],
-      "city": data["city"],
-      "state": data["state"],
-      "phone": data["phone"],
-      "website": data["website"],
-      "facebook_link": data["facebook_link"],
-      "seeking_venue": data["seeking_venue"],
-      "seeking_description": data["seeking_description"],
-      "image_link": data["image_link"]
-    }
     # TODO: populate form with values from artist with ID <artist_id>
     return render_template('forms/edit_artist.html', form=form, artist=artist)
   except Exception as e:
@@ -414,7 +596,10 @@ def edit_artist_submission(artist_id):
       artist.phone = artist_dict["phone"]
       artist.facebook_link = artist_dict["facebook_link"]
       update_genres_artist(new_genres, artist)
+      page_keys = get_artist_page_keys(artist_id)
       db.session.commit()
+      response_cache.invalidate(*page_keys)
+      index_name('artist', artist_id, artist_dict["name"])
       flash('Artist ' + request.form['name'] + ' was successfully edited!')
       return redirect(url_for('show_artist', artist_id=artist_id))
   except Exception as e:
@@ -433,25 +618,10 @@ def edit_venue(venue_id):
   """
   form = VenueForm()
   try:
-    result = Venue.query.filter_by(id=venue_id).all()
-    if len(result) == 0 :
+    venue = Venue.load_fields(venue_id, EDIT_VENUE_FIELDS)
+    if venue is None:
       print("No result for found for venue id {}".format(venue_id))
       abort(404)
-    data = result[0].format_all()
-    venue = {
-      "id": data["id"],
-      "name": data["name"],
-      "genres": data["genres"],
-      "address": data["address"],
-      "city": data["city"],
-      "state": data["state"],
-      "phone": data["phone"],
-      "website": data["website"],
-      "facebook_link": data["facebook_link"],
-      "seeking_talent": data["seeking_talent"],
-      "seeking_description": data["seeking_description"],
-      "image_link": data["image_link"]
-    }
     return render_template('forms/edit_venue.html', form=form, venue=venue)
   except Exception as e:
     print("Error occured while fetching data for venue ", e)
@@ -482,7 +652,10 @@ def edit_venue_submission(venue_id):
       venue.phone = venue_dict["phone"]
       venue.facebook_link = venue_dict["facebook_link"]
       update_genres_venue(new_genres, venue)
+      page_keys = get_venue_page_keys(venue_id)
       db.session.commit()
+      response_cache.invalidate(*page_keys)
+      index_name('venue', venue_id, venue_dict["name"])
       flash('Venue ' + request.form['name'] + ' was successfully edited!')
       return redirect(url_for('show_venue', venue_id=venue_id))
   except Exception as e:
@@ -520,6 +693,7 @@ def create_artist_submission():
                   website_link=artist_dict['website_link'], image_link=artist_dict['image_link'],\
                   seeking_venue=seeking_venue, seeking_description=artist_dict['seeking_description'])
     artist.create(genres)
+    response_cache.invalidate('artists')
     flash('artist ' + request.form['name'] + ' was successfully listed!')
   except Exception as e:
     print("Error while creating new artist: ", e)
@@ -530,27 +704,46 @@ def create_artist_submission():
   return render_template('pages/home.html')
 
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/autocomplete/<any(venues, artists):entity>')
+def autocomplete(entity):
+  """
+  Returns the venues or artists whose name starts with the query parameter q, used by the
+  pickers on the new show form
+  """
+  try:
+    prefix = request.args.get('q', '')
+    limit = min(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int),\
+                app.config['AUTOCOMPLETE_MAX_LIMIT'])
+    data = search.autocomplete(entity[:-1], prefix, limit)
+    return jsonify({"data": data})
+  except Exception as e:
+    print("Error occurred in autocomplete: ", e)
+    print(traceback.format_exc())
+    abort(500)
+
+
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional_page(lambda: get_listing_version('venue', 'artist', 'show'))
+@cached_page('shows')
 def shows():
   """Displays list of shows at /shows"""
-  shows_raw = Show.query.all()
   data = []
   try:
-    for show in shows_raw:
-      show_dict = show.get_show_dict()
-      if show_dict:
-        data.append(show_dict)  
-    if len(data) == 0:
+    data = peek_rows(Show.get_listing(get_listing_batch_size()))
+    if data is None:
       print("No records found for shows")
       abort(404)
   except Exception as e:
     print("Error occured in fetching shows: ",e)
     print(traceback.format_exc())
     abort(500)
-  return render_template('pages/shows.html', shows=data)
+  return render_listing('pages/shows.html', shows=data)
 
 @app.route('/shows/create')
 def create_shows():
@@ -566,20 +759,129 @@ def create_show_submission():
   Called to create new shows in the db, upon submitting new show listing form
   """
   
+  form = ShowForm(request.form)
   try:
     request.get_data()
     show_dict = request.form.to_dict()
-    show = Show(venue_id=show_dict["venue_id"], artist_id=show_dict["artist_id"], start_time=show_dict["start_time"])
+    # runs the IntegerField and NumberRange validators of the duration only, the form has no CSRF token
+    if not form.duration.validate(form):
+      raise ValueError('Invalid duration. {}'.format(form.duration.errors[0]))
+    show = Show(venue_id=int(show_dict["venue_id"]), artist_id=int(show_dict["artist_id"]),\
+                start_time=parse_start_time(show_dict["start_time"]),\
+                duration=form.duration.data or DEFAULT_SHOW_DURATION)
     show.create()
+    response_cache.invalidate(*get_show_page_keys(show_dict["venue_id"], show_dict["artist_id"]))
     flash('Show was successfully listed!')
     return render_template('pages/home.html')  
+  except ShowConflictError as e:
+    flash('Show could not be listed. {}'.format(e))
+    return render_template('forms/new_show.html', form=form), 409
+  except (ValueError, OverflowError) as e:
+    flash('Show could not be listed. {}'.format(e))
+    return render_template('forms/new_show.html', form=form), 400
   except Exception as e:
     print("Error in creating new show: ", e)
     print(traceback.format_exc())
     flash('An error occurred. Show could not be listed.')
     abort(500)
   
+
+@app.route('/shows/batch/create')
+def create_show_batch():
+  """
+  Renders the form listing many shows of one artist at one venue, e.g. a residency
+  """
+  form = ShowBatchForm()
+  return render_template('forms/new_show_batch.html', form=form)
+
+@app.route('/shows/batch/create', methods=['POST'])
+def create_show_batch_submission():
+  """
+  Creates every show of a recurrence, or of a list of start times, with one multi-row insert.
+  Shows that already exist are skipped and reported
+  """
+  form = ShowBatchForm(request.form)
+  max_occurrences = app.config['SHOW_BATCH_MAX_OCCURRENCES']
+  try:
+    venue_id, artist_id = int(form.venue_id.data), int(form.artist_id.data)
+    if not form.duration.validate(form):
+      raise ValueError('Invalid duration. {}'.format(form.duration.errors[0]))
+    if form.start_times.data and form.start_times.data.strip():
+      start_times = parse_start_times(form.start_times.data.splitlines(), max_occurrences)
+    else:
+      start_time, until = get_form_datetime(form.start_time), get_form_datetime(form.until)
+      if start_time is None:
+        raise ValueError('A valid start time is required')
+      elif form.frequency.data:
+        start_times = expand_recurrence(start_time, form.frequency.data, form.interval.data or 1,\
+                                        form.count.data, until, max_occurrences)
+      else:
+        start_times = [start_time]
+    result = Show.create_batch(venue_id, artist_id, start_times, form.duration.data or DEFAULT_SHOW_DURATION)
+  except ShowConflictError as e:
+    flash('Shows could not be listed. {}'.format(e))
+    return render_template('forms/new_show_batch.html', form=form), 409
+  except ValueError as e:
+    flash('Shows could not be listed. {}'.format(e))
+    return render_template('forms/new_show_batch.html', form=form), 400
+  except Exception as e:
+    print("Error in creating a batch of shows: ", e)
+    print(traceback.format_exc())
+    flash('An error occurred. Shows could not be listed.')
+    abort(500)
+  if result['created']:
+    response_cache.invalidate(*get_show_page_keys(venue_id, artist_id))
+  message = '{} shows were successfully listed!'.format(len(result['created']))
+  if result['duplicates']:
+    message += ' {} already listed were skipped: {}'.format(len(result['duplicates']),\
+                                                            ', '.join(start_time.strftime('%Y-%m-%d %H:%M') for start_time in result['duplicates'][:10]))
+  flash(message)
+  return render_template('pages/home.html')
   
+  
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<any(venues, artists, shows):entity>.<any(csv, ndjson):file_format>')
+def export_catalog(entity, file_format):
+  """
+  Streams every venue, artist or show as CSV or NDJSON. Rows are read through a server-side cursor
+  and sent in chunks, so memory stays flat however large the catalog is
+  """
+  try:
+    chunks = exporter.generate_export(entity, file_format)
+    response = Response(stream_with_context(chunks), mimetype=exporter.EXPORT_MIMETYPES[file_format])
+    response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(entity, file_format)
+    return response
+  except Exception as e:
+    print("Error occurred while exporting {}: ".format(entity),e)
+    print(traceback.format_exc())
+    abort(500)
+
+
+#  Stats
+#  ----------------------------------------------------------------
+
+@app.route('/stats/cache')
+def cache_stats():
+  """
+  Reports the hit and miss counters of the page cache and the entity cache
+  """
+  return jsonify({"responses": response_cache.stats(),\
+                  "entities": entity_cache.stats()})
+
+
+@app.route('/stats/pool')
+def pool_stats():
+  """
+  Reports the state and counters of the connection pools of the primary and the replicas
+  """
+  stats = {"primary": get_pool_stats(db.engine)}
+  for bind in app.config['DB_REPLICA_BINDS']:
+    stats[bind] = get_pool_stats(db.get_engine(app, bind=bind))
+  return jsonify(stats)
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
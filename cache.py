@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from collections import OrderedDict
+
+#----------------------------------------------------------------------------#
+# Caches.
+#----------------------------------------------------------------------------#
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a time to live. Keeps hit, miss,
+    eviction and invalidation counters so that the cache can be sized from data.
+
+    The cache is local to the process: invalidations only reach the process that made the
+    change, other workers catch up when their entries expire. Entries can be tagged with the
+    version of the data they were built from, read from the database on every request, so that
+    no worker serves an entry older than what the database holds, see get.
+    """
+
+    def __init__(self, max_entries=512, ttl=30):
+      self.max_entries = max_entries
+      self.ttl = ttl
+      self.entries = OrderedDict()   # key -> (expiry time, version, value), least recently used first
+      self.lock = threading.Lock()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+      self.expirations = 0
+      self.stale = 0
+      self.invalidations = 0
+
+    def get(self, key, version=None):
+      """
+      Returns the value cached under key, or None when it is missing, expired or was cached for
+      another version
+
+      Parameters:
+        key (hashable): cache key
+        version (hashable): version the value must have been cached with, see set
+      """
+      with self.lock:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+          del self.entries[key]
+          self.expirations += 1
+          entry = None
+        elif entry is not None and entry[1] != version:
+          del self.entries[key]
+          self.stale += 1
+          entry = None
+        if entry is None:
+          self.misses += 1
+          return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key, value, ttl=None, version=None):
+      """
+      Caches value under key, evicting the least recently used entries beyond max_entries
+
+      Parameters:
+        key (hashable): cache key
+        value (object): value to cache, must not be None
+        ttl (int): seconds until the entry expires, defaults to the cache's ttl
+        version (hashable): version of the data the value was built from, get only returns the
+                            value for the same version
+      """
+      if self.max_entries <= 0:
+        return
+      with self.lock:
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), version, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+          self.entries.popitem(last=False)
+          self.evictions += 1
+
+    def invalidate(self, *keys):
+      """
+      Drops the given keys from the cache
+      """
+      with self.lock:
+        for key in keys:
+          if self.entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+      """
+      Drops every entry, counters are kept
+      """
+      with self.lock:
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    def stats(self):
+      """
+      Returns the cache counters
+      """
+      with self.lock:
+        lookups = self.hits + self.misses
+        return {
+          'entries': len(self.entries),
+          'max_entries': self.max_entries,
+          'hits': self.hits,
+          'misses': self.misses,
+          'hit_ratio': self.hits / lookups if lookups else 0.0,
+          'evictions': self.evictions,
+          'expirations': self.expirations,
+          'stale': self.stale,
+          'invalidations': self.invalidations
+        }
+
+
+# rendered pages of the listing and detail routes, sized by the app from RESPONSE_CACHE_SIZE
+# and RESPONSE_CACHE_TTL. Module level so that the API can invalidate the pages it makes stale
+response_cache = TTLCache()
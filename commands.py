@@ -0,0 +1,398 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import click
+import time
+import babel.dates
+import dateutil.parser
+import jinja2
+from datetime import datetime, timedelta
+from sqlalchemy import text, event
+from model import db, genre_cache, entity_cache, sync_genres, roll_show_counts, rebuild_show_counts, Venue, Artist, Show, VenueGenre
+from constants import DATETIME_FORMATS
+from search import build_name_index, escape_like, LIKE_ESCAPE
+from text_index import name_indexes
+from importer import import_file
+from exporter import generate_export, EXPORT_BATCH_SIZE
+from cache import response_cache
+
+#----------------------------------------------------------------------------#
+# Query plans.
+#----------------------------------------------------------------------------#
+
+# Queries served by the indexes added in migrations 7a3e91c4d2b8 and 5b1e7c9d3f24
+HOT_QUERIES = [
+  ('shows of an artist by time',
+   'SELECT venue_id, start_time FROM show WHERE artist_id = :artist_id AND start_time > :now ORDER BY start_time'),
+  ('shows in a time range',
+   'SELECT venue_id, artist_id, start_time FROM show WHERE start_time > :now ORDER BY start_time LIMIT 50'),
+  ('venues in an area',
+   'SELECT id, name FROM venue WHERE city = :city AND state = :state'),
+  ('venues by genre',
+   'SELECT venue_id FROM venuegenre WHERE genre_id = (SELECT id FROM genre WHERE name = :genre)'),
+  ('artists by genre',
+   'SELECT artist_id FROM artistgenre WHERE genre_id = (SELECT id FROM genre WHERE name = :genre)'),
+]
+
+# Planner switches that make PostgreSQL ignore secondary indexes, used to show the "before" plan
+NO_INDEX_SETTINGS = ['enable_indexscan', 'enable_bitmapscan', 'enable_indexonlyscan']
+
+
+def get_sample_params():
+  """
+  Picks parameter values for the hot queries from the existing data
+
+  Returns:
+    params (dict): bind parameters shared by all the queries in HOT_QUERIES
+  """
+  venue = db.session.query(Venue.city, Venue.state).first()
+  artist = db.session.query(Artist.id).first()
+  return {
+    'artist_id': artist.id if artist else 0,
+    'city': venue.city if venue else '',
+    'state': venue.state if venue else '',
+    'genre': 'Jazz',
+    'now': db.session.query(db.func.now()).scalar()
+  }
+
+
+def explain(connection, sql, params):
+  """
+  Returns the query plan for a statement as a list of lines
+  """
+  if connection.dialect.name == 'postgresql':
+    rows = connection.execute(text('EXPLAIN ' + sql), params)
+  else:
+    rows = connection.execute(text('EXPLAIN QUERY PLAN ' + sql), params)
+  return [' '.join(str(col) for col in row) for row in rows]
+
+
+#----------------------------------------------------------------------------#
+# Name index report.
+#----------------------------------------------------------------------------#
+
+def get_sample_terms(index, sample_size):
+  """
+  Derives search terms from indexed names: whole names, prefixes, infixes and short fragments
+  """
+  terms = []
+  for name in list(index.names.values())[:sample_size]:
+    middle = len(name) // 2
+    terms.extend([name, name[:4], name[middle:middle + 5], name[-2:], name[:1]])
+  return [term for term in terms if term]
+
+
+def check_parity(index, model, terms):
+  """
+  Compares index results with the ILIKE results of the database
+
+  Returns:
+    mismatches (list): (term, index ids, database ids) for every disagreement
+  """
+  mismatches = []
+  for term in terms:
+    expected = [row.id for row in db.session.query(model.id)\
+                                            .filter(model.name.ilike('%{}%'.format(escape_like(term)), escape=LIKE_ESCAPE))\
+                                            .order_by(model.id)]
+    found = index.search(term)
+    if found != expected:
+      mismatches.append((term, found, expected))
+  return mismatches
+
+
+#----------------------------------------------------------------------------#
+# Genre sync benchmark.
+#----------------------------------------------------------------------------#
+
+def update_genres_per_row(venue, names):
+  """
+  The genre update used before model.sync_genres, kept as the baseline of benchmark-genre-sync:
+  loads the genres relationship, then deletes and adds one row at a time
+  """
+  genre_ids = set(genre_cache.get_ids(names, create=True).values())
+  common_genre_ids = set()
+  for genre in venue.genres:
+    if genre.genre_id in genre_ids:
+      common_genre_ids.add(genre.genre_id)
+    else:
+      db.session.delete(genre)
+  for genre_id in genre_ids - common_genre_ids:
+    db.session.add(VenueGenre(venue_id=venue.id, genre_id=genre_id))
+  db.session.flush()
+  # the next edit comes with a new request, which loads the relationship again
+  db.session.expire(venue, ['genres'])
+
+
+#----------------------------------------------------------------------------#
+# Query counts.
+#----------------------------------------------------------------------------#
+
+# pages whose number of statements must not grow with the catalog
+LISTING_PAGES = ('/venues', '/artists', '/shows')
+
+
+def count_page_statements(app, url):
+  """
+  Counts the statements run to serve a page, body included since listings are streamed. The
+  request runs in the command's app context, so it sees the rows the command has flushed, and
+  the caches, genre names included, are emptied first so that the page is built from the database
+
+  Returns:
+    statements (int): number of statements executed
+  """
+  statements = []
+
+  def count_statement(connection, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  response_cache.clear()
+  entity_cache.clear()
+  genre_cache.clear()
+  event.listen(db.engine, 'before_cursor_execute', count_statement)
+  try:
+    with app.test_request_context(url):
+      response = app.full_dispatch_request()
+      response.get_data()
+      response.close()
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', count_statement)
+  return len(statements)
+
+
+def add_throwaway_catalog(size):
+  """
+  Flushes size venues and artists with one show each, to be rolled back by the caller
+  """
+  venues = [Venue('Query count venue {}'.format(i), 'Query count city {}'.format(i % 3), 'CA', '', '', '', '', '', False, '')\
+            for i in range(size)]
+  artists = [Artist('Query count artist {}'.format(i), '', 'NY', '', '', '', '', True, '') for i in range(size)]
+  db.session.add_all(venues + artists)
+  db.session.flush()
+  start = datetime.now() + timedelta(days=3650)
+  db.session.add_all([Show(venue_id=venue.id, artist_id=artist.id, start_time=start + timedelta(days=i))\
+                      for i, (venue, artist) in enumerate(zip(venues, artists))])
+  db.session.flush()
+
+
+def register_commands(app):
+  """
+  Registers the fyyur CLI commands on the flask app
+  """
+
+  @app.cli.command('explain-indexes')
+  def explain_indexes():
+    """
+    Prints query plans of the hot queries. On PostgreSQL the "before" plan is produced with
+    index scans disabled for the transaction, other databases only print the current plan
+    """
+    params = get_sample_params()
+    connection = db.engine.connect()
+    try:
+      is_postgres = connection.dialect.name == 'postgresql'
+      for title, sql in HOT_QUERIES:
+        click.echo('== {}'.format(title))
+        if is_postgres:
+          trans = connection.begin()
+          for setting in NO_INDEX_SETTINGS:
+            connection.execute(text('SET LOCAL {} = off'.format(setting)))
+          click.echo('-- before (sequential scans only)')
+          for line in explain(connection, sql, params):
+            click.echo('   ' + line)
+          trans.rollback()
+        click.echo('-- after')
+        for line in explain(connection, sql, params):
+          click.echo('   ' + line)
+    finally:
+      connection.close()
+
+  @app.cli.command('search-index-report')
+  @click.option('--sample', default=200, help='Number of names to derive parity check terms from.')
+  def search_index_report(sample):
+    """
+    Prints the memory footprint of the in-memory name indexes, their query latency and
+    whether they return the same ids as ILIKE for terms taken from the indexed names
+    """
+    for model in (Venue, Artist):
+      index = name_indexes.get(model.__tablename__) or build_name_index(model)
+      click.echo('== {}'.format(model.__tablename__))
+      for key, value in index.memory_usage().items():
+        click.echo('   {}: {}'.format(key, value))
+      terms = get_sample_terms(index, sample)
+      start = time.perf_counter()
+      for term in terms:
+        index.search(term)
+      elapsed = time.perf_counter() - start
+      click.echo('   mean query time: {:.1f}us over {} terms'.format(elapsed * 1e6 / max(len(terms), 1), len(terms)))
+      mismatches = check_parity(index, model, terms)
+      click.echo('   parity with ILIKE: {}'.format('ok' if not mismatches else '{} mismatches'.format(len(mismatches))))
+      for term, found, expected in mismatches[:10]:
+        click.echo('     {!r}: index {} database {}'.format(term, found[:10], expected[:10]))
+
+  @app.cli.command('import-catalog')
+  @click.argument('entity', type=click.Choice(['venues', 'artists', 'shows']))
+  @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+  @click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+  @click.option('--batch-size', default=1000, help='Rows per insert and commit.')
+  def import_catalog(entity, path, file_format, batch_size):
+    """
+    Bulk imports venues, artists or shows from a CSV or JSONL file. Import venues and artists
+    first, the ids they are given are printed for the show files to reference
+    """
+    report = import_file(entity, path, file_format, batch_size)
+    click.echo('{}: {} rows inserted, {} rejected in {:.2f}s ({:.0f} rows/s)'\
+               .format(entity, report.inserted, report.rejected, report.elapsed, report.rows_per_second()))
+    if report.first_id is not None:
+      click.echo('   ids {} to {}'.format(report.first_id, report.last_id))
+    for line_number, reason in report.rejections:
+      click.echo('   line {}: {}'.format(line_number, reason))
+    if report.rejected > len(report.rejections):
+      click.echo('   ... {} more rejected rows'.format(report.rejected - len(report.rejections)))
+
+  @app.cli.command('export-catalog')
+  @click.argument('entity', type=click.Choice(['venues', 'artists', 'shows']))
+  @click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default='csv')
+  @click.option('--output', type=click.File('w'), default='-', help='File to write, defaults to stdout.')
+  @click.option('--batch-size', default=EXPORT_BATCH_SIZE, help='Rows fetched and written at a time.')
+  def export_catalog(entity, file_format, output, batch_size):
+    """
+    Streams every venue, artist or show to a CSV or NDJSON file, the same export as /export
+    """
+    for chunk in generate_export(entity, file_format, batch_size):
+      output.write(chunk)
+
+  @app.cli.command('benchmark-genre-sync')
+  @click.option('--genres', default=40, help='Number of genres of the venue.')
+  @click.option('--rounds', default=20, help='Number of edits timed per implementation.')
+  def benchmark_genre_sync(genres, rounds):
+    """
+    Times the per-row genre update against sync_genres on a throwaway venue whose edits alternate
+    between two genre sets sharing half their genres. Runs in one transaction that is rolled back
+    """
+    statements = []   # number of parameter sets of each statement
+
+    def count_statement(connection, cursor, statement, parameters, context, executemany):
+      # psycopg2 runs an executemany as one round trip per parameter set
+      statements.append(len(parameters) if executemany else 1)
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+      venue = Venue('Genre sync benchmark', '', '', '', '', '', '', '', False, '')
+      db.session.add(venue)
+      db.session.flush()
+      names = ['Benchmark genre {}'.format(i) for i in range(genres + genres // 2)]
+      genre_cache.get_ids(names, create=True)
+      genre_sets = [names[:genres], names[genres // 2:]]
+      for label, update in (('per row', lambda genre_names: update_genres_per_row(venue, genre_names)),\
+                            ('set based', lambda genre_names: sync_genres(Venue, venue.id, genre_names))):
+        del statements[:]
+        start = time.perf_counter()
+        for i in range(rounds):
+          update(genre_sets[i % 2])
+        elapsed = time.perf_counter() - start
+        click.echo('{:>9}: {:.2f}ms, {:.1f} statements and {:.1f} parameter sets per edit'\
+                   .format(label, elapsed * 1000 / rounds, len(statements) / rounds, sum(statements) / rounds))
+    finally:
+      event.remove(db.engine, 'before_cursor_execute', count_statement)
+      db.session.rollback()
+
+  @app.cli.command('roll-show-counts')
+  @click.option('--rebuild', is_flag=True, help='Recount every show instead of rolling the counters forward.')
+  def roll_show_counts_command(rebuild):
+    """
+    Moves the shows that started since the last run from the upcoming to the past show counters of
+    venues and artists. Schedule it every few minutes, e.g. from cron
+    """
+    if rebuild:
+      rebuild_show_counts()
+      click.echo('show counters rebuilt')
+    else:
+      click.echo('{} shows moved to the past counters'.format(roll_show_counts()))
+
+  @app.cli.command('benchmark-date-format')
+  @click.option('--tiles', default=500, help='Number of show tiles rendered per round.')
+  @click.option('--rounds', default=20, help='Number of renders timed per implementation.')
+  def benchmark_date_format(tiles, rounds):
+    """
+    Times the show tiles of the venue and artist pages with start times carried as ISO strings,
+    parsed back with dateutil and formatted by babel.dates.format_datetime on every tile, against
+    native datetimes and the cached formatter of the datetime filter
+    """
+    def format_iso_string(value, format='medium'):
+      return babel.dates.format_datetime(dateutil.parser.parse(value), DATETIME_FORMATS.get(format, format))
+
+    tile = '{% for show in shows %}<h5>{{ show.artist_name }}</h5><h6>{{ show.start_time|datetime(\'full\') }}</h6>{% endfor %}'
+    now = datetime.now()
+    start_times = [now + timedelta(days=i, minutes=i * 7) for i in range(tiles)]
+    outputs = []
+    for label, to_value, date_filter in (('ISO strings', lambda start_time: start_time.isoformat(), format_iso_string),\
+                                         ('native', lambda start_time: start_time, app.jinja_env.filters['datetime'])):
+      environment = jinja2.Environment()
+      environment.filters['datetime'] = date_filter
+      template = environment.from_string(tile)
+      start = time.perf_counter()
+      for i in range(rounds):
+        # building the show dictionaries is timed too, the model used to convert every start time
+        output = template.render(shows=[{'artist_name': 'Artist', 'start_time': to_value(start_time)}\
+                                        for start_time in start_times])
+      elapsed = time.perf_counter() - start
+      outputs.append(output)
+      click.echo('{:>11}: {:.1f}us per tile'.format(label, elapsed * 1e6 / (rounds * tiles)))
+    click.echo('identical output: {}'.format('yes' if outputs[0] == outputs[1] else 'no'))
+
+  @app.cli.command('benchmark-listing-stream')
+  @click.option('--rounds', default=10, help='Number of requests timed per page and mode.')
+  def benchmark_listing_stream(rounds):
+    """
+    Times the first byte and the whole body of /venues, /artists and /shows rendered to a string
+    before sending, against streamed with STREAM_LISTINGS. The page cache is emptied before each
+    request so that every one renders
+    """
+    client = app.test_client()
+    streamed = app.config['STREAM_LISTINGS']
+    try:
+      for url, cache_key in (('/venues', 'venues'), ('/artists', 'artists'), ('/shows', 'shows')):
+        bodies = []
+        for label, stream in (('whole', False), ('streamed', True)):
+          app.config['STREAM_LISTINGS'] = stream
+          first_byte = total = 0
+          for i in range(rounds):
+            response_cache.invalidate(cache_key)
+            start = time.perf_counter()
+            response = client.get(url)
+            chunks = iter(response.response)
+            body = [next(chunks, b'')]
+            first_byte += time.perf_counter() - start
+            body.extend(chunks)
+            total += time.perf_counter() - start
+            response.close()
+          bodies.append(b''.join(body))
+          click.echo('{:>8} {:>8}: first byte {:.1f}ms, whole page {:.1f}ms, {} bytes'\
+                     .format(url, label, first_byte * 1e3 / rounds, total * 1e3 / rounds, len(bodies[-1])))
+        click.echo('{:>8} identical output: {}'.format(url, 'yes' if bodies[0] == bodies[1] else 'no'))
+    finally:
+      app.config['STREAM_LISTINGS'] = streamed
+
+  @app.cli.command('check-query-counts')
+  @click.option('--size', default=50, help='Number of venues, artists and shows added for the second count.')
+  def check_query_counts(size):
+    """
+    Checks that the listing pages run as many statements with size more venues, artists and shows
+    as without, i.e. that none of them queries per row. The rows are added in a transaction that
+    is rolled back. Exits with an error when a count grows, to be run in CI
+    """
+    grown = []
+    try:
+      before = {url: count_page_statements(app, url) for url in LISTING_PAGES}
+      add_throwaway_catalog(size)
+      for url in LISTING_PAGES:
+        after = count_page_statements(app, url)
+        click.echo('{:>8}: {} statements, {} with {} more rows'.format(url, before[url], after, size))
+        if after > before[url]:
+          grown.append(url)
+    finally:
+      db.session.rollback()
+      response_cache.clear()
+      entity_cache.clear()
+    if grown:
+      raise click.ClickException('statement count grows with the catalog on {}'.format(', '.join(grown)))
@@ -1,4 +1,5 @@
 from sqlalchemy.engine.url import URL
+from db_pool import InstrumentedQueuePool
 import os
 
 SECRET_KEY = os.urandom(32)
@@ -19,9 +20,64 @@ POSTGRES_DB = {'drivername': 'postgresql',
 SQLALCHEMY_DATABASE_URI = URL(**POSTGRES_DB)
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Maximum number of results shown by venue and artist search
+SEARCH_RESULT_LIMIT = int(os.getenv('SEARCH_RESULT_LIMIT', 20))
+
+# 'database' searches with ILIKE/pg_trgm, 'memory' answers from an in-process n-gram index
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'database')
+
+# Seconds between two checks of the in-memory name indexes for names written by other processes,
+# see search.sync_name_indexes
+SEARCH_INDEX_SYNC_SECONDS = int(os.getenv('SEARCH_INDEX_SYNC_SECONDS', 5))
+
+# Rendered page cache for the listing and detail pages, a size of 0 disables it
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 30))
+
+# Stream the /venues, /artists and /shows pages: the layout is sent before the rows are read, which
+# then arrive from a server-side cursor LISTING_BATCH_SIZE at a time. The template output is sent in
+# chunks of STREAM_BUFFER_SIZE pieces
+STREAM_LISTINGS = os.getenv('STREAM_LISTINGS', 'true').lower() == 'true'
+LISTING_BATCH_SIZE = int(os.getenv('LISTING_BATCH_SIZE', 500))
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 20))
+
+# Formatted venues and artists memoized by Venue/Artist.get_formatted
+ENTITY_CACHE_SIZE = int(os.getenv('ENTITY_CACHE_SIZE', 2048))
+ENTITY_CACHE_TTL = int(os.getenv('ENTITY_CACHE_TTL', 60))
+
+# Default and maximum number of suggestions returned by /autocomplete
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# Default and maximum page size of the JSON API
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Largest number of shows created by one batch or recurrence, see /shows/batch
+SHOW_BATCH_MAX_OCCURRENCES = int(os.getenv('SHOW_BATCH_MAX_OCCURRENCES', 5000))
+
+# Connection pool, sized per deployment. See /stats/pool for the numbers to size it from
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))                   # seconds to wait for a connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))                 # seconds, -1 keeps connections forever
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))          # milliseconds, 0 disables
+SQLALCHEMY_ENGINE_OPTIONS = {"poolclass": InstrumentedQueuePool,
+                             "pool_size": DB_POOL_SIZE,
+                             "max_overflow": DB_MAX_OVERFLOW,
+                             "pool_timeout": DB_POOL_TIMEOUT,
+                             "pool_recycle": DB_POOL_RECYCLE,
+                             "pool_pre_ping": DB_POOL_PRE_PING}
+if DB_STATEMENT_TIMEOUT > 0:
+    SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"options": "-c statement_timeout={}".format(DB_STATEMENT_TIMEOUT)}
+
+# Read replicas, a comma separated list of database URLs. GET requests read from a random replica,
+# writes and the requests of a user who wrote in the last DB_READ_YOUR_WRITES_SECONDS use the primary
+DB_REPLICA_URLS = [url.strip() for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url.strip()]
+DB_READ_YOUR_WRITES_SECONDS = int(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5))
+SQLALCHEMY_BINDS = {'replica_{}'.format(i): url for i, url in enumerate(DB_REPLICA_URLS)}
+DB_REPLICA_BINDS = sorted(SQLALCHEMY_BINDS)
+
 ## Optional Configs
 # SQLALCHEMY_ECHO = True
-# DB_POOL_SIZE = 20
-# DB_MAX_OVERFLOW = 5
-# SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": DB_POOL_SIZE,
-#                             "max_overflow" : DB_MAX_OVERFLOW}
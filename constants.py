@@ -1,3 +1,13 @@
 # Global variables
 FUTURE = "future"
 PAST = "past"
+
+# show durations, in minutes. Overlap checks look this far back for shows still running
+DEFAULT_SHOW_DURATION = 120
+MAX_SHOW_DURATION = 24 * 60
+
+# Babel patterns of the datetime template filter, other format values are used as patterns themselves
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+#----------------------------------------------------------------------------#
+# Pool statistics.
+#----------------------------------------------------------------------------#
+
+class PoolStats:
+    """
+    Counters of an InstrumentedQueuePool: checkout wait times, timeouts, the peak number of
+    connections in use and connection churn
+    """
+
+    def __init__(self):
+      self.lock = threading.Lock()
+      self.checkouts = 0
+      self.wait_total = 0.0
+      self.wait_max = 0.0
+      self.timeouts = 0
+      self.peak_checked_out = 0
+      self.peak_overflow = 0
+      self.connects = 0
+      self.closes = 0
+      self.invalidations = 0
+
+    def record_checkout(self, wait, checked_out, overflow):
+      with self.lock:
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.peak_checked_out = max(self.peak_checked_out, checked_out)
+        self.peak_overflow = max(self.peak_overflow, overflow)
+
+    def increment(self, counter):
+      with self.lock:
+        setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self):
+      with self.lock:
+        return {
+          'checkouts': self.checkouts,
+          'wait_mean_ms': self.wait_total * 1000 / self.checkouts if self.checkouts else 0.0,
+          'wait_max_ms': self.wait_max * 1000,
+          'timeouts': self.timeouts,
+          'peak_checked_out': self.peak_checked_out,
+          'peak_overflow': self.peak_overflow,
+          'connects': self.connects,
+          'closes': self.closes,
+          'invalidations': self.invalidations
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records how long checkouts wait for a connection, including the time to open
+    one when the pool grows, and how often connections are opened, closed and invalidated.
+    Statistics survive the pool being recreated on dispose or after a disconnect.
+    """
+
+    def __init__(self, *args, **kwargs):
+      super().__init__(*args, **kwargs)
+      self.stats = PoolStats()
+
+    def _do_get(self):
+      start = time.perf_counter()
+      try:
+        connection = super()._do_get()
+      except exc.TimeoutError:
+        self.stats.increment('timeouts')
+        raise
+      self.stats.record_checkout(time.perf_counter() - start, self.checkedout(), max(self.overflow(), 0))
+      return connection
+
+    def _create_connection(self):
+      self.stats.increment('connects')
+      return super()._create_connection()
+
+    def _close_connection(self, connection):
+      self.stats.increment('closes')
+      super()._close_connection(connection)
+
+    def _invalidate(self, connection, exception=None, _checkin=True):
+      self.stats.increment('invalidations')
+      super()._invalidate(connection, exception, _checkin)
+
+    def recreate(self):
+      pool = super().recreate()
+      pool.stats = self.stats
+      return pool
+
+
+def get_pool_stats(engine):
+  """
+  Reports the state of an engine's connection pool
+
+  Parameters:
+    engine (Engine): engine whose pool is reported
+
+  Returns:
+    stats (dict): pool size, connections in use, overflow and idle connections, plus the counters
+                  of PoolStats when the pool is instrumented
+  """
+  pool = engine.pool
+  stats = {'pool': type(pool).__name__}
+  if isinstance(pool, QueuePool):
+    stats.update({
+      'size': pool.size(),
+      'checked_out': pool.checkedout(),
+      'overflow': max(pool.overflow(), 0),
+      'idle': pool.checkedin()
+    })
+  if isinstance(pool, InstrumentedQueuePool):
+    stats.update(pool.stats.as_dict())
+  return stats
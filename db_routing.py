@@ -0,0 +1,103 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import random
+import time
+from flask import g, request, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+# methods served from a replica, unless the view is marked with replica_reads
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# cookie holding the time of the user's last write, see pin_after_write
+LAST_WRITE_COOKIE = 'db_last_write'
+
+#----------------------------------------------------------------------------#
+# Session routing.
+#----------------------------------------------------------------------------#
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends the reads of a request to the replica picked for it by choose_replica.
+    Flushes, and therefore every INSERT, UPDATE and DELETE issued through the ORM, always go to
+    the primary, as does everything outside of a request (CLI commands, migrations, startup).
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+      replica = g.get('db_replica') if has_app_context() else None
+      if replica is not None and not self._flushing:
+        return get_state(self.app).db.get_engine(self.app, bind=replica)
+      return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy extension whose scoped session is a RoutingSession
+    """
+
+    def create_session(self, options):
+      return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+#----------------------------------------------------------------------------#
+# Request hooks.
+#----------------------------------------------------------------------------#
+
+def replica_reads(view):
+  """
+  Marks a view that does not write as safe to serve from a replica even though it is not a GET,
+  such as the search forms which are posted
+  """
+  view.replica_reads = True
+  return view
+
+
+def is_read_request(app):
+  view = app.view_functions.get(request.endpoint)
+  return request.method in READ_METHODS or getattr(view, 'replica_reads', False)
+
+
+def in_write_window():
+  """
+  Tells whether the reads of the request are pinned to the primary because the user wrote in the
+  last DB_READ_YOUR_WRITES_SECONDS. The shared page and entity caches are filled by everyone,
+  from replicas that may not have the write yet, so such requests read past them
+  """
+  return has_app_context() and g.get('db_pinned', False)
+
+
+def setup_routing(app):
+  """
+  Registers the request hooks that route reads to the replicas configured in DB_REPLICA_BINDS.
+
+  Reads are pinned to the primary for DB_READ_YOUR_WRITES_SECONDS after the user's last write, so
+  that the redirect following a form post shows the change even when the replicas lag behind.
+  The caches are skipped for those reads too, see in_write_window.
+
+  The time of the write is kept in a cookie of its own rather than in the Flask session, which is
+  signed with SECRET_KEY and would be dropped by any worker started with a different key. The
+  cookie is not signed: forging it only sends the user's own reads to the primary, as a write does.
+  """
+
+  @app.before_request
+  def choose_replica():
+    replicas = app.config['DB_REPLICA_BINDS']
+    if not replicas or not is_read_request(app):
+      return
+    try:
+      last_write = float(request.cookies.get(LAST_WRITE_COOKIE, ''))
+    except ValueError:
+      last_write = None
+    if last_write is not None and time.time() - last_write < app.config['DB_READ_YOUR_WRITES_SECONDS']:
+      g.db_pinned = True
+      return
+    g.db_replica = random.choice(replicas)
+
+  @app.after_request
+  def pin_after_write(response):
+    if app.config['DB_REPLICA_BINDS'] and not is_read_request(app):
+      response.set_cookie(LAST_WRITE_COOKIE, repr(time.time()),\
+                          max_age=app.config['DB_READ_YOUR_WRITES_SECONDS'], httponly=True)
+    return response
@@ -0,0 +1,132 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+from datetime import datetime
+from model import db, Venue, Artist, Show, Genre, VenueGenre, ArtistGenre
+from importer import VENUE_FIELDS, ARTIST_FIELDS, GENRE_SEPARATOR
+
+#----------------------------------------------------------------------------#
+# Streaming export.
+#----------------------------------------------------------------------------#
+
+# rows fetched per round trip from the server-side cursor, and written per chunk
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def get_genre_names(model, genre_model, foreign_key, dialect):
+  """
+  Builds a correlated subquery joining the genre names of each venue or artist with GENRE_SEPARATOR,
+  the format read back by the importer
+  """
+  if dialect == 'postgresql':
+    names = db.func.string_agg(Genre.name, GENRE_SEPARATOR)
+  else:
+    names = db.func.group_concat(Genre.name, GENRE_SEPARATOR)
+  return db.session.query(names)\
+                   .select_from(genre_model)\
+                   .join(Genre, Genre.id == genre_model.genre_id)\
+                   .filter(foreign_key == model.id)\
+                   .correlate(model)\
+                   .as_scalar()
+
+
+def get_export_query(entity):
+  """
+  Builds the query of an export, selecting plain columns in an order served by an index so the
+  database can stream rows without sorting them first. The generators read it with yield_per,
+  which turns on stream_results: PostgreSQL reads through a server-side cursor and only one
+  batch of rows is held in memory at a time
+
+  Parameters:
+    entity (str): 'venues', 'artists' or 'shows'
+
+  Returns:
+    query (Query): query over the rows to export
+  """
+  dialect = db.engine.dialect.name
+  if entity == 'venues':
+    return db.session.query(Venue.id, *[getattr(Venue, field) for field in VENUE_FIELDS],\
+                            get_genre_names(Venue, VenueGenre, VenueGenre.venue_id, dialect).label('genres'))\
+                     .order_by(Venue.id)
+  elif entity == 'artists':
+    return db.session.query(Artist.id, *[getattr(Artist, field) for field in ARTIST_FIELDS],\
+                            get_genre_names(Artist, ArtistGenre, ArtistGenre.artist_id, dialect).label('genres'))\
+                     .order_by(Artist.id)
+  elif entity == 'shows':
+    return db.session.query(Show.venue_id,\
+                            Venue.name.label('venue_name'),\
+                            Show.artist_id,\
+                            Artist.name.label('artist_name'),\
+                            Show.start_time,\
+                            Show.duration)\
+                     .join(Venue, Venue.id == Show.venue_id)\
+                     .join(Artist, Artist.id == Show.artist_id)\
+                     .order_by(Show.start_time)
+  raise ValueError("Invalid entity for export")
+
+
+def to_text(value):
+  return value.isoformat() if isinstance(value, datetime) else value
+
+
+def generate_csv(entity, batch_size=EXPORT_BATCH_SIZE):
+  """
+  Generates an export as CSV chunks, the header first so the response starts immediately
+  """
+  query = get_export_query(entity)
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow([column['name'] for column in query.column_descriptions])
+  yield buffer.getvalue()
+  buffer.seek(0)
+  buffer.truncate()
+  for count, row in enumerate(query.yield_per(batch_size), 1):
+    writer.writerow([to_text(value) for value in row])
+    if count % batch_size == 0:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue()
+
+
+def generate_ndjson(entity, batch_size=EXPORT_BATCH_SIZE):
+  """
+  Generates an export as newline delimited JSON chunks, genres as a list
+  """
+  lines = []
+  for row in get_export_query(entity).yield_per(batch_size):
+    record = {key: to_text(value) for key, value in row._asdict().items()}
+    if 'genres' in record:
+      record['genres'] = record['genres'].split(GENRE_SEPARATOR) if record['genres'] else []
+    lines.append(json.dumps(record) + '\n')
+    if len(lines) == batch_size:
+      yield ''.join(lines)
+      lines = []
+  if lines:
+    yield ''.join(lines)
+
+
+def generate_export(entity, file_format, batch_size=EXPORT_BATCH_SIZE):
+  """
+  Generates an export of venues, artists or shows in chunks, memory use depends on batch_size only
+
+  Parameters:
+    entity (str): 'venues', 'artists' or 'shows'
+    file_format (str): 'csv' or 'ndjson'
+    batch_size (int): rows fetched and written at a time
+
+  Returns:
+    chunks (generator): text chunks of the export
+  """
+  if file_format == 'csv':
+    return generate_csv(entity, batch_size)
+  elif file_format == 'ndjson':
+    return generate_ndjson(entity, batch_size)
+  raise ValueError("Invalid format for export")
@@ -0,0 +1,81 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from model import db, entity_cache, genre_cache, get_facet_columns
+
+#----------------------------------------------------------------------------#
+# Facets.
+#----------------------------------------------------------------------------#
+
+# query parameters of the listing pages and the API that filter venues and artists
+FILTER_ARGS = ('genre', 'state', 'seeking')
+TRUE_VALUES = ('true', 'yes', '1')
+
+
+def get_filters(args):
+  """
+  Reads the genre, state and seeking filters from the query string
+
+  Parameters:
+    args (MultiDict): request.args
+
+  Returns:
+    filters (dict): the filters present, seeking as a boolean
+  """
+  filters = {}
+  for name in FILTER_ARGS:
+    value = args.get(name, '').strip()
+    if value:
+      filters[name] = value.lower() in TRUE_VALUES if name == 'seeking' else value
+  return filters
+
+
+def get_facet_counts(model, version=None, cached=True):
+  """
+  Counts venues or artists per genre, per state and by seeking flag with one UNION ALL of
+  three GROUP BY queries. Counts are memoized in the entity cache under ('facets', table name)
+  and evicted when the model's rows or genre associations change, see model.record_changes
+
+  Parameters:
+    model (Venue|Artist): model whose facets are counted
+    version (tuple): version of the listing the counts are shown on, see app.get_listing_version.
+                     Cached counts are only reused for the same version, so a worker that did not
+                     see the change does not serve stale ones
+    cached (bool): False to read past the cache, e.g. from the primary right after a write,
+                   the entry is refreshed
+
+  Returns:
+    facets (dict): 'genres' and 'states' as (value, count) lists, 'seeking' as a count. The
+                   dictionary is shared between requests and must not be modified
+  """
+  key = ('facets', model.__tablename__)
+  facets = entity_cache.get(key, version) if cached else None
+  if facets is not None:
+    return facets
+  genre_model, owner_column, seeking_column = get_facet_columns(model)
+  genre_counts = db.session.query(db.literal('genre').label('facet'),\
+                                  db.cast(genre_model.genre_id, db.String).label('value'),\
+                                  db.func.count().label('total'))\
+                           .group_by(genre_model.genre_id)
+  state_counts = db.session.query(db.literal('state'), model.state, db.func.count())\
+                           .filter(model.state.isnot(None))\
+                           .group_by(model.state)
+  seeking_counts = db.session.query(db.literal('seeking'), db.literal('true'), db.func.count())\
+                             .filter(seeking_column.is_(True))
+  genres, states, seeking = [], [], 0
+  for facet, value, total in genre_counts.union_all(state_counts, seeking_counts):
+    if facet == 'genre':
+      genres.append((int(value), total))
+    elif facet == 'state':
+      states.append((value, total))
+    else:
+      seeking = total
+  names = genre_cache.get_names([genre_id for genre_id, total in genres])
+  facets = {
+    'genres': sorted(zip(names, (total for genre_id, total in genres)), key=lambda facet: (-facet[1], facet[0])),
+    'states': sorted(states),
+    'seeking': seeking
+  }
+  entity_cache.set(key, facets, version=version)
+  return facets
@@ -1,7 +1,8 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField, TextAreaField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
+from constants import DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -17,6 +18,60 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=MAX_SHOW_DURATION)],
+        default=DEFAULT_SHOW_DURATION
+    )
+
+class ShowBatchForm(Form):
+    artist_id = StringField(
+        'artist_id',
+        validators=[DataRequired()]
+    )
+    venue_id = StringField(
+        'venue_id',
+        validators=[DataRequired()]
+    )
+    # rendered in the format the placeholders advertise, the route parses other formats too
+    start_time = DateTimeField(
+        'start_time',
+        validators=[Optional()],
+        format='%Y-%m-%d %H:%M',
+        default= datetime.today()
+    )
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=MAX_SHOW_DURATION)],
+        default=DEFAULT_SHOW_DURATION
+    )
+    frequency = SelectField(
+        'frequency',
+        choices=[
+            ('', 'Does not repeat'),
+            ('daily', 'Daily'),
+            ('weekly', 'Weekly'),
+            ('monthly', 'Monthly'),
+        ]
+    )
+    interval = IntegerField(
+        'interval',
+        validators=[Optional(), NumberRange(min=1)],
+        default=1
+    )
+    count = IntegerField(
+        'count',
+        validators=[Optional(), NumberRange(min=1)]
+    )
+    until = DateTimeField(
+        'until',
+        validators=[Optional()],
+        format='%Y-%m-%d %H:%M'
+    )
+    # one start time per line, used instead of the recurrence when given
+    start_times = TextAreaField(
+        'start_times'
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -0,0 +1,395 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import os
+import time
+import dateutil.parser
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import text
+from model import db, record_changes, count_shows, genre_cache, check_duration, get_end_time, Venue, Artist, Show, Genre, VenueGenre, ArtistGenre
+from intervals import IntervalIndex, check_intervals
+from constants import DEFAULT_SHOW_DURATION
+from text_index import index_name
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+# columns read from venue and artist files, besides genres
+VENUE_FIELDS = ('name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+                'website_link', 'seeking_talent', 'seeking_description')
+ARTIST_FIELDS = ('name', 'city', 'state', 'phone', 'image_link', 'facebook_link',
+                 'website_link', 'seeking_venue', 'seeking_description')
+BOOLEAN_FIELDS = ('seeking_talent', 'seeking_venue')
+TRUE_VALUES = ('true', 't', 'yes', 'y', '1')
+
+# separator of the genres column in CSV files, JSONL files carry a list
+GENRE_SEPARATOR = ';'
+
+# number of rejected rows whose reason is kept for the report, the rest are only counted
+MAX_REPORTED_REJECTIONS = 20
+
+
+class ImportReport:
+    """
+    Outcome of an import: rows inserted, rows rejected with the reason for the first few, the
+    range of ids handed out and the throughput
+    """
+
+    def __init__(self, entity):
+      self.entity = entity
+      self.inserted = 0
+      self.rejected = 0
+      self.rejections = []   # (line number, reason)
+      self.first_id = None
+      self.last_id = None
+      self.start = time.perf_counter()
+      self.elapsed = 0.0
+
+    def reject(self, line_number, reason):
+      self.rejected += 1
+      if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+        self.rejections.append((line_number, str(reason)))
+
+    def add(self, count, ids=None):
+      self.inserted += count
+      if ids:
+        self.first_id = ids[0] if self.first_id is None else self.first_id
+        self.last_id = ids[-1]
+      self.elapsed = time.perf_counter() - self.start
+
+    def rows_per_second(self):
+      return self.inserted / self.elapsed if self.elapsed else 0.0
+
+
+def read_records(path, file_format=None):
+  """
+  Streams the records of a CSV or JSONL file one at a time
+
+  Parameters:
+    path (str): file to read
+    file_format (str): 'csv' or 'jsonl', defaults to the file extension
+
+  Returns:
+    records (generator): (line number, record dict) pairs
+  """
+  file_format = file_format or ('csv' if os.path.splitext(path)[1].lower() == '.csv' else 'jsonl')
+  with open(path, newline='', encoding='utf-8') as stream:
+    if file_format == 'csv':
+      reader = csv.DictReader(stream)
+      for record in reader:
+        yield reader.line_num, record
+    else:
+      for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+          continue
+        try:
+          yield line_number, json.loads(line)
+        except ValueError:
+          yield line_number, None   # rejected by the parse functions
+
+
+def get_batches(records, batch_size):
+  """
+  Groups a stream of records into lists of at most batch_size, keeping one batch in memory
+  """
+  while True:
+    batch = list(islice(records, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def parse_boolean(value):
+  if isinstance(value, bool) or value is None:
+    return bool(value)
+  return str(value).strip().lower() in TRUE_VALUES
+
+
+def parse_entity(model, fields, record):
+  """
+  Validates a venue or artist record and converts it to column values
+
+  Returns:
+    row (dict): column values of the venue or artist
+    genres (list): distinct genre names
+
+  Raises:
+    ValueError: if the name is missing or a value does not fit its column
+  """
+  if not isinstance(record, dict):
+    raise ValueError('not a JSON object')
+  row = {}
+  for field in fields:
+    value = record.get(field)
+    if field in BOOLEAN_FIELDS:
+      value = parse_boolean(value)
+    elif value is not None:
+      value = str(value).strip() or None
+      length = model.__table__.c[field].type.length
+      if value is not None and length is not None and len(value) > length:
+        raise ValueError('{} is longer than {} characters'.format(field, length))
+    row[field] = value
+  if not row['name']:
+    raise ValueError('name is required')
+  genres = record.get('genres') or []
+  if isinstance(genres, str):
+    genres = genres.split(GENRE_SEPARATOR)
+  genres = list(dict.fromkeys(genre.strip() for genre in genres if genre and genre.strip()))
+  for genre in genres:
+    if len(genre) > Genre.__table__.c.name.type.length:
+      raise ValueError('genre {!r} is too long'.format(genre))
+  return row, genres
+
+
+def parse_show(record):
+  """
+  Validates a show record and converts it to column values
+
+  Raises:
+    ValueError: if an id or the start time is missing or malformed, or the duration is invalid
+  """
+  if not isinstance(record, dict):
+    raise ValueError('not a JSON object')
+  try:
+    start_time = record['start_time']
+    start_time = start_time if isinstance(start_time, datetime) else dateutil.parser.parse(str(start_time))
+    if start_time.tzinfo is not None:
+      # start times are stored as naive local times, like the ones entered in the show form
+      start_time = start_time.astimezone().replace(tzinfo=None)
+    duration = record.get('duration')
+    return {'venue_id': int(record['venue_id']),
+            'artist_id': int(record['artist_id']),
+            'start_time': start_time,
+            'duration': check_duration(int(duration)) if duration not in (None, '') else DEFAULT_SHOW_DURATION}
+  except KeyError as e:
+    raise ValueError('{} is required'.format(e.args[0]))
+  except (TypeError, OverflowError) as e:
+    raise ValueError(str(e))
+
+
+def get_id_allocator(connection, model):
+  """
+  Hands out primary keys for rows inserted without the ORM, which need them up front to link
+  the genre rows
+
+  On PostgreSQL the ids are drawn from the table's sequence, so concurrent inserts through the
+  app are safe. Elsewhere ids continue from max(id), which assumes nothing else inserts while
+  the import runs
+
+  Returns:
+    allocate (function): takes the connection of the current batch and a count, returns that
+                         many new ids in ascending order
+  """
+  if connection.dialect.name == 'postgresql':
+    def allocate(connection, count):
+      rows = connection.execute(text("SELECT nextval(pg_get_serial_sequence(:table, 'id'))"
+                                     " FROM generate_series(1, :count)"),
+                                table=model.__tablename__, count=count)
+      return sorted(row[0] for row in rows)
+    return allocate
+  next_id = [(connection.execute(db.select([db.func.max(model.id)])).scalar() or 0) + 1]
+
+  def allocate(connection, count):
+    ids = list(range(next_id[0], next_id[0] + count))
+    next_id[0] += count
+    return ids
+  return allocate
+
+
+def bulk_insert(connection, table, rows):
+  """
+  Inserts rows with COPY on PostgreSQL and with a single executemany elsewhere
+
+  Parameters:
+    connection (Connection): connection of the session's transaction
+    table (Table): target table
+    rows (list): dictionaries with the same keys, the columns to fill
+  """
+  if not rows:
+    return
+  columns = list(rows[0])
+  if connection.dialect.name == 'postgresql':
+    preparer = connection.dialect.identifier_preparer
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # None is written as an unquoted empty field, which COPY reads as NULL
+    writer.writerows([row[column] for column in columns] for row in rows)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+      cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'\
+                         .format(preparer.format_table(table), ', '.join(preparer.quote(column) for column in columns)),\
+                         buffer)
+    finally:
+      cursor.close()
+  else:
+    connection.execute(table.insert(), rows)
+
+
+def import_entities(model, genre_model, fields, records, batch_size):
+  """
+  Imports venues or artists along with their genres, committing one batch at a time. Each batch
+  costs a constant number of statements: the id allocation, the genre lookup (plus the insert of
+  new genres), the entity insert and the genre association insert
+
+  Parameters:
+    model (Venue|Artist): model to import
+    genre_model (VenueGenre|ArtistGenre): genre model of the entity
+    fields (tuple): columns read from the records
+    records (iterable): (line number, record) pairs, see read_records
+    batch_size (int): rows per insert and commit
+
+  Returns:
+    report (ImportReport): rows inserted and rejected
+  """
+  entity = model.__tablename__
+  foreign_key = '{}_id'.format(entity)
+  report = ImportReport(entity)
+  allocate = None
+  try:
+    for batch in get_batches(iter(records), batch_size):
+      parsed = []
+      for line_number, record in batch:
+        try:
+          parsed.append(parse_entity(model, fields, record))
+        except ValueError as e:
+          report.reject(line_number, e)
+      if not parsed:
+        continue
+      connection = db.session.connection()
+      allocate = allocate or get_id_allocator(connection, model)
+      ids = allocate(connection, len(parsed))
+      now = datetime.utcnow()
+      genre_ids = genre_cache.get_ids([genre for row, genres in parsed for genre in genres], create=True)
+      rows, genre_rows = [], []
+      for doc_id, (row, genres) in zip(ids, parsed):
+        row.update(id=doc_id, updated_at=now)
+        rows.append(row)
+        genre_rows.extend({foreign_key: doc_id, 'genre_id': genre_ids[genre]} for genre in genres)
+      bulk_insert(connection, model.__table__, rows)
+      bulk_insert(connection, genre_model.__table__, genre_rows)
+      record_changes(db.session, [], [], [entity], now)
+      db.session.commit()
+      # only reaches the indexes of this process, web workers pick the names up through
+      # search.sync_name_indexes
+      for row in rows:
+        index_name(entity, row['id'], row['name'])
+      report.add(len(rows), ids)
+  except Exception as e:
+    db.session.rollback()
+    raise e
+  finally:
+    db.session.close()
+  return report
+
+
+def import_shows(records, batch_size):
+  """
+  Imports shows, committing one batch at a time. The venue and artist ids of a batch are checked
+  with one IN query each, which also locks the venues, and the shows of those venues around the
+  batch are loaded with one more. Rows pointing at missing venues or artists, repeating a show or
+  overlapping another show of their venue are rejected, overlaps are found with an IntervalIndex
+  per venue
+
+  Parameters:
+    records (iterable): (line number, record) pairs, see read_records
+    batch_size (int): rows per insert and commit
+
+  Returns:
+    report (ImportReport): rows inserted and rejected
+  """
+  report = ImportReport(Show.__tablename__)
+  try:
+    for batch in get_batches(iter(records), batch_size):
+      parsed = []
+      for line_number, record in batch:
+        try:
+          parsed.append((line_number, parse_show(record)))
+        except ValueError as e:
+          report.reject(line_number, e)
+      if not parsed:
+        continue
+      venue_ids = set(row['venue_id'] for line_number, row in parsed)
+      artist_ids = set(row['artist_id'] for line_number, row in parsed)
+      known_venues = Show.lock_venues(venue_ids)
+      known_artists = set(artist_id for artist_id, in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids)))
+      bookings = Show.get_bookings(known_venues,\
+                                   min(row['start_time'] for line_number, row in parsed),\
+                                   max(get_end_time(row['start_time'], row['duration']) for line_number, row in parsed))
+      seen = set((venue_id, artist_id, start_time) for venue_id, intervals in bookings.items()\
+                                                   for start, end, (artist_id, start_time) in intervals)
+      now = datetime.utcnow()
+      shows = {}   # venue id -> (start time, end time, (line number, row)) intervals to check
+      for line_number, row in parsed:
+        key = (row['venue_id'], row['artist_id'], row['start_time'])
+        if row['venue_id'] not in known_venues:
+          report.reject(line_number, 'unknown venue {}'.format(row['venue_id']))
+        elif row['artist_id'] not in known_artists:
+          report.reject(line_number, 'unknown artist {}'.format(row['artist_id']))
+        elif key in seen:
+          report.reject(line_number, 'duplicate show')
+        else:
+          seen.add(key)
+          shows.setdefault(row['venue_id'], [])\
+               .append((row['start_time'], get_end_time(row['start_time'], row['duration']), (line_number, row)))
+      rows = []
+      for venue_id, intervals in shows.items():
+        accepted, conflicts = check_intervals(IntervalIndex(bookings[venue_id]), intervals)
+        for (line_number, row), conflict in conflicts:
+          if isinstance(conflict[1], dict):
+            report.reject(line_number, 'overlaps the show of line {}'.format(conflict[0]))
+          else:
+            report.reject(line_number, 'overlaps the show of artist {} at {:%Y-%m-%d %H:%M}'.format(*conflict))
+        for start_time, end_time, (line_number, row) in accepted:
+          row['updated_at'] = now
+          rows.append(row)
+      if not rows:
+        continue
+      bulk_insert(db.session.connection(), Show.__table__, rows)
+      count_shows(db.session, [(row['venue_id'], row['artist_id'], row['start_time']) for row in rows])
+      record_changes(db.session,\
+                     set(row['venue_id'] for row in rows),\
+                     set(row['artist_id'] for row in rows),\
+                     [Show.__tablename__], now)
+      db.session.commit()
+      report.add(len(rows))
+  except Exception as e:
+    db.session.rollback()
+    raise e
+  finally:
+    db.session.close()
+  return report
+
+
+def import_file(entity, path, file_format=None, batch_size=1000):
+  """
+  Imports a CSV or JSONL file of venues, artists or shows. Memory use depends on the batch size,
+  not on the size of the file
+
+  CSV files have a header row naming the columns, genres are separated by GENRE_SEPARATOR. JSONL
+  files have one object per line, genres as a list. Venue and artist ids are assigned in file
+  order and reported, shows reference them through venue_id and artist_id
+
+  Parameters:
+    entity (str): 'venues', 'artists' or 'shows'
+    path (str): file to import
+    file_format (str): 'csv' or 'jsonl', defaults to the file extension
+    batch_size (int): rows per insert and commit
+
+  Returns:
+    report (ImportReport): rows inserted and rejected
+  """
+  records = read_records(path, file_format)
+  if entity == 'venues':
+    return import_entities(Venue, VenueGenre, VENUE_FIELDS, records, batch_size)
+  elif entity == 'artists':
+    return import_entities(Artist, ArtistGenre, ARTIST_FIELDS, records, batch_size)
+  elif entity == 'shows':
+    return import_shows(records, batch_size)
+  raise ValueError("Invalid entity for import")
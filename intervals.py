@@ -0,0 +1,75 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from bisect import bisect_left
+
+#----------------------------------------------------------------------------#
+# Interval index.
+#----------------------------------------------------------------------------#
+
+class IntervalIndex:
+    """
+    Static index over half-open intervals [start, end) answering "does anything overlap
+    [start, end)?" in O(log n).
+
+    Intervals are sorted by start and each position keeps the interval with the latest end among
+    those up to it. The intervals starting before a query ends are a prefix found by bisection, and
+    one of them overlaps the query exactly when the latest end of that prefix is after its start.
+    Built once per check from the rows of one query, there is no insertion: use check_intervals
+    to add a batch that must not overlap itself either.
+    """
+
+    def __init__(self, intervals=()):
+      intervals = sorted(intervals, key=lambda interval: interval[0])
+      self.starts = [start for start, end, item in intervals]
+      self.latest = []   # (end, item) of the interval with the latest end up to each position
+      for start, end, item in intervals:
+        if not self.latest or end > self.latest[-1][0]:
+          self.latest.append((end, item))
+        else:
+          self.latest.append(self.latest[-1])
+
+    def __len__(self):
+      return len(self.starts)
+
+    def find_overlap(self, start, end):
+      """
+      Finds an interval overlapping [start, end)
+
+      Returns:
+        item (object): item of an overlapping interval, None if there is none
+      """
+      position = bisect_left(self.starts, end)
+      if position and self.latest[position - 1][0] > start:
+        return self.latest[position - 1][1]
+      return None
+
+
+def check_intervals(index, intervals):
+  """
+  Splits new intervals into those that can be added to the index and those that overlap it or an
+  earlier interval of the batch, in O(log n) per interval after sorting the batch
+
+  Parameters:
+    index (IntervalIndex): existing intervals
+    intervals (iterable): (start, end, item) new intervals
+
+  Returns:
+    accepted (list): (start, end, item) intervals overlapping nothing, in start order
+    conflicts (list): (item, conflicting item) pairs, the conflicting item of the index or batch
+  """
+  accepted, conflicts = [], []
+  latest = None   # (end, item) of the accepted interval of the batch that ends last
+  for start, end, item in sorted(intervals, key=lambda interval: interval[0]):
+    # accepted intervals all start at or before this one, only the latest end can reach it
+    conflict = index.find_overlap(start, end)
+    if conflict is None and latest is not None and latest[0] > start:
+      conflict = latest[1]
+    if conflict is not None:
+      conflicts.append((item, conflict))
+      continue
+    accepted.append((start, end, item))
+    if latest is None or end > latest[0]:
+      latest = (end, item)
+  return accepted, conflicts
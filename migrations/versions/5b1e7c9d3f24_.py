@@ -0,0 +1,58 @@
+"""normalize genres into a genre table
+
+Creates the genre table from the distinct names in venuegenre and artistgenre
+and replaces the name column of both association tables with a small integer
+genre_id. The primary keys become (venue_id, genre_id) and (artist_id, genre_id)
+and genre_id gets the index the name column had.
+
+Revision ID: 5b1e7c9d3f24
+Revises: e8b27f5a0c93
+Create Date: 2020-10-09 19:42:11.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7c9d3f24'
+down_revision = 'e8b27f5a0c93'
+branch_labels = None
+depends_on = None
+
+# association table -> column referencing the venue or artist
+ASSOCIATIONS = (('venuegenre', 'venue_id'), ('artistgenre', 'artist_id'))
+
+
+def upgrade():
+    op.create_table('genre',
+    sa.Column('id', sa.SmallInteger(), nullable=False),
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.execute('INSERT INTO genre (name) '
+               'SELECT name FROM venuegenre UNION SELECT name FROM artistgenre ORDER BY name')
+    for table, owner_column in ASSOCIATIONS:
+        op.add_column(table, sa.Column('genre_id', sa.SmallInteger(), nullable=True))
+        op.execute('UPDATE {0} SET genre_id = (SELECT id FROM genre WHERE genre.name = {0}.name)'.format(table))
+        op.alter_column(table, 'genre_id', nullable=False)
+        op.drop_constraint('{}_pkey'.format(table), table, type_='primary')
+        op.drop_index('ix_{}_name'.format(table), table_name=table)
+        op.drop_column(table, 'name')
+        op.create_primary_key('{}_pkey'.format(table), table, [owner_column, 'genre_id'])
+        op.create_foreign_key(None, table, 'genre', ['genre_id'], ['id'])
+        op.create_index('ix_{}_genre_id'.format(table), table, ['genre_id'], unique=False)
+
+
+def downgrade():
+    for table, owner_column in ASSOCIATIONS:
+        op.add_column(table, sa.Column('name', sa.String(length=30), nullable=True))
+        op.execute('UPDATE {0} SET name = (SELECT name FROM genre WHERE genre.id = {0}.genre_id)'.format(table))
+        op.alter_column(table, 'name', nullable=False)
+        op.drop_constraint('{}_pkey'.format(table), table, type_='primary')
+        op.drop_index('ix_{}_genre_id'.format(table), table_name=table)
+        op.drop_column(table, 'genre_id')
+        op.create_primary_key('{}_pkey'.format(table), table, [owner_column, 'name'])
+        op.create_index('ix_{}_name'.format(table), table, ['name'], unique=False)
+    op.drop_table('genre')
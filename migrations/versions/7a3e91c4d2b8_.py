@@ -0,0 +1,38 @@
+"""add indexes for the hot access paths
+
+Indexes are built with CREATE INDEX CONCURRENTLY so that the migration can be
+applied to a live database without blocking writes. Concurrent builds cannot
+run inside a transaction, hence the autocommit block.
+
+Revision ID: 7a3e91c4d2b8
+Revises: 2199b649dcac
+Create Date: 2020-10-03 18:21:07.614305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3e91c4d2b8'
+down_revision = '2199b649dcac'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_show_start_time', 'show', ['start_time'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_venue_city_state', 'venue', ['city', 'state'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_venuegenre_name', 'venuegenre', ['name'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_artistgenre_name', 'artistgenre', ['name'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_artistgenre_name', table_name='artistgenre', postgresql_concurrently=True)
+        op.drop_index('ix_venuegenre_name', table_name='venuegenre', postgresql_concurrently=True)
+        op.drop_index('ix_venue_city_state', table_name='venue', postgresql_concurrently=True)
+        op.drop_index('ix_show_start_time', table_name='show', postgresql_concurrently=True)
+        op.drop_index('ix_show_artist_id_start_time', table_name='show', postgresql_concurrently=True)
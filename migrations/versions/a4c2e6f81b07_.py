@@ -0,0 +1,32 @@
+"""add state indexes for the listing filters
+
+Serves the state filter of /venues, /artists and the API, the genre filter
+uses the genre_id indexes of the association tables. Built concurrently like
+the indexes of 7a3e91c4d2b8.
+
+Revision ID: a4c2e6f81b07
+Revises: 5b1e7c9d3f24
+Create Date: 2020-10-10 16:05:48.310927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c2e6f81b07'
+down_revision = '5b1e7c9d3f24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_state', 'venue', ['state'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_artist_state', 'artist', ['state'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_artist_state', table_name='artist', postgresql_concurrently=True)
+        op.drop_index('ix_venue_state', table_name='venue', postgresql_concurrently=True)
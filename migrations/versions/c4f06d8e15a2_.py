@@ -0,0 +1,39 @@
+"""add trigram indexes for venue and artist name search
+
+Requires the pg_trgm extension. The GIN indexes are built concurrently so the
+migration can be applied without blocking writes. Other databases are left
+untouched and fall back to a LIKE scan.
+
+Revision ID: c4f06d8e15a2
+Revises: 7a3e91c4d2b8
+Create Date: 2020-10-04 12:40:52.118903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f06d8e15a2'
+down_revision = '7a3e91c4d2b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_name_trgm', 'venue', ['name'], unique=False, postgresql_concurrently=True,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index('ix_artist_name_trgm', 'artist', ['name'], unique=False, postgresql_concurrently=True,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_artist_name_trgm', table_name='artist', postgresql_concurrently=True)
+        op.drop_index('ix_venue_name_trgm', table_name='venue', postgresql_concurrently=True)
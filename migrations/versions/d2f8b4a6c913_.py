@@ -0,0 +1,69 @@
+"""add show durations and forbid overlapping shows at a venue
+
+Adds show.duration in minutes and the (venue_id, start_time) index the overlap
+checks scan. On PostgreSQL the show_venue_id_excl exclusion constraint makes
+overlapping shows of a venue impossible, it needs btree_gist for the equality
+on venue_id. Existing shows get the default duration, cut short at the next
+show of their venue so that past data satisfies the constraint. Shortened shows
+are logged. Shows starting less than a minute apart at a venue cannot be fixed
+that way: the upgrade then fails listing them, for an operator to move or
+delete them.
+
+Revision ID: d2f8b4a6c913
+Revises: a4c2e6f81b07
+Create Date: 2020-10-11 20:14:37.902561
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f8b4a6c913'
+down_revision = 'a4c2e6f81b07'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+# every show with the start time of the next show of its venue
+FOLLOWING_SHOWS = ('SELECT venue_id, artist_id, start_time, '
+                   'LEAD(start_time) OVER (PARTITION BY venue_id ORDER BY start_time, artist_id) AS next_start '
+                   'FROM show')
+
+
+def upgrade():
+    op.add_column('show', sa.Column('duration', sa.Integer(), server_default='120', nullable=False))
+    op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'], unique=False)
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    # a duration under a minute would be an empty range, which check_duration rejects for new shows
+    clashes = bind.execute(sa.text('SELECT venue_id, artist_id, start_time, next_start FROM ({}) AS following '
+                                   "WHERE next_start < start_time + interval '1 minute' "
+                                   'ORDER BY venue_id, start_time'.format(FOLLOWING_SHOWS))).fetchall()
+    if clashes:
+        raise RuntimeError('{} shows start less than a minute before the next show of their venue, move or delete '
+                           'them and upgrade again. (venue_id, artist_id, start_time, next start_time): {}'
+                           .format(len(clashes), ', '.join(str(tuple(str(value) for value in clash)) for clash in clashes)))
+    shortened = bind.execute(sa.text('UPDATE show SET duration = FLOOR(EXTRACT(EPOCH FROM following.next_start - show.start_time) / 60) '
+                                     'FROM ({}) AS following '
+                                     'WHERE following.venue_id = show.venue_id AND following.artist_id = show.artist_id '
+                                     'AND following.start_time = show.start_time '
+                                     "AND following.next_start < show.start_time + show.duration * interval '1 minute' "
+                                     'RETURNING show.venue_id, show.artist_id, show.start_time, show.duration'
+                                     .format(FOLLOWING_SHOWS))).fetchall()
+    for venue_id, artist_id, start_time, duration in shortened:
+        logger.warning('Shortened the show of artist %s at venue %s on %s to %s minutes, it overlapped the next show',
+                       artist_id, venue_id, start_time, duration)
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.execute('ALTER TABLE show ADD CONSTRAINT show_venue_id_excl EXCLUDE USING gist '
+               "(venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE show DROP CONSTRAINT show_venue_id_excl')
+    op.drop_index('ix_show_venue_id_start_time', table_name='show')
+    op.drop_column('show', 'duration')
@@ -0,0 +1,42 @@
+"""track modification times of venues, artists and shows
+
+Adds updated_at to venue, artist and show, and a table_version table holding
+a version counter per table, for conditional GET on the listing and detail
+pages. Existing rows start at the time of the migration.
+
+Revision ID: e8b27f5a0c93
+Revises: c4f06d8e15a2
+Create Date: 2020-10-06 21:08:33.570142
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b27f5a0c93'
+down_revision = 'c4f06d8e15a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    now = sa.text("(now() at time zone 'utc')")
+    for table in ('venue', 'artist', 'show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=now))
+        op.alter_column(table, 'updated_at', server_default=None)
+    table_version = op.create_table('table_version',
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_version, [{'name': name, 'version': 0, 'updated_at': datetime.utcnow()}
+                                   for name in ('venue', 'artist', 'show')])
+
+
+def downgrade():
+    op.drop_table('table_version')
+    for table in ('show', 'artist', 'venue'):
+        op.drop_column(table, 'updated_at')
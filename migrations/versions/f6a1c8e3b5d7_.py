@@ -0,0 +1,51 @@
+"""add upcoming and past show counters to venue and artist
+
+The counters are kept in step by the transactions writing shows and rolled
+forward by `flask roll-show-counts` as shows start. show_count_watermark holds
+the time up to which shows are counted as past, the counters are filled as of
+the time of the upgrade.
+
+Revision ID: f6a1c8e3b5d7
+Revises: d2f8b4a6c913
+Create Date: 2020-10-12 18:37:52.116043
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6a1c8e3b5d7'
+down_revision = 'd2f8b4a6c913'
+branch_labels = None
+depends_on = None
+
+# counted table -> its column in show
+COUNTED_TABLES = (('venue', 'venue_id'), ('artist', 'artist_id'))
+
+
+def upgrade():
+    watermark = op.create_table('show_count_watermark',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('counted_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # start times are stored in local time
+    now = datetime.now()
+    for table, show_column in COUNTED_TABLES:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.get_bind().execute(sa.text(
+            'UPDATE {0} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM show WHERE show.{1} = {0}.id AND show.start_time > :now), '
+            'past_shows_count = (SELECT count(*) FROM show WHERE show.{1} = {0}.id AND show.start_time <= :now)'
+            .format(table, show_column)), now=now)
+    op.bulk_insert(watermark, [{'id': 1, 'counted_until': now}])
+
+
+def downgrade():
+    for table, show_column in COUNTED_TABLES:
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
+    op.drop_table('show_count_watermark')
@@ -1,14 +1,97 @@
-from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
-from datetime import datetime
+from db_routing import RoutingSQLAlchemy
+db = RoutingSQLAlchemy()
+from sqlalchemy import event, inspect, exc, DDL
+from sqlalchemy.dialects import postgresql
+from datetime import datetime, timedelta
+import threading
 import traceback
-from constants import FUTURE, PAST
+from constants import FUTURE, PAST, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+from intervals import IntervalIndex, check_intervals
+from text_index import index_name
+from cache import TTLCache
+
+# formatted venues and artists keyed by (table name, id), see Venue.get_formatted, and their facet
+# counts keyed by ('facets', table name), see facets.get_facet_counts
+entity_cache = TTLCache()
 
 
 def setup_db(app):
+    # the schema is created and upgraded by the migrations, `flask db upgrade`. Creating the tables
+    # here would add the ones of newer models before the migrations creating them can run
     db.app = app
     db.init_app(app)
-    db.create_all()
+    entity_cache.max_entries = app.config['ENTITY_CACHE_SIZE']
+    entity_cache.ttl = app.config['ENTITY_CACHE_TTL']
+
+def filter_by_tense(query, tense, now=None):
+    """
+    Restricts a query over shows to upcoming or past shows
+
+    Parameters:
+      query (Query): query that selects from the show table
+      tense (str): FUTURE or PAST
+      now (datetime): reference time, defaults to the current time
+
+    Returns:
+      query (Query): query filtered on Show.start_time
+    """
+    now = now or datetime.now()
+    if tense == FUTURE:
+        return query.filter(Show.start_time > now)
+    elif tense == PAST:
+        return query.filter(Show.start_time < now)
+    raise ValueError("Invalid tense for shows")
+
+def get_facet_columns(model):
+    """
+    Gets the genre association model, its venue or artist column and the seeking column of a model
+    """
+    if model is Venue:
+        return VenueGenre, VenueGenre.venue_id, Venue.seeking_talent
+    return ArtistGenre, ArtistGenre.artist_id, Artist.seeking_venue
+
+def filter_by_facets(query, model, filters):
+    """
+    Restricts a query over venues or artists to a genre, a state and a seeking flag. The genre is
+    resolved to its id through genre_cache and matched on the indexed genre_id of the association
+    table
+
+    Parameters:
+      query (Query): query selecting from the model
+      model (Venue|Artist): model being listed
+      filters (dict): 'genre', 'state' and 'seeking' values, see facets.get_filters
+
+    Returns:
+      query (Query): the filtered query
+    """
+    genre_model, owner_column, seeking_column = get_facet_columns(model)
+    if filters.get('genre') is not None:
+        genre_id = genre_cache.get_ids([filters['genre']]).get(filters['genre'])
+        if genre_id is None:
+            return query.filter(db.false())
+        query = query.filter(model.id.in_(db.session.query(owner_column).filter(genre_model.genre_id == genre_id)))
+    if filters.get('state') is not None:
+        query = query.filter(model.state == filters['state'])
+    if filters.get('seeking') is not None:
+        query = query.filter(seeking_column == filters['seeking'])
+    return query
+
+def get_rows_of(query, batch_size=None):
+    """
+    Runs a listing query, either at once or lazily for streamed pages. With a batch_size the query
+    is only sent when the rows are first iterated and is read with yield_per, which turns on
+    stream_results: PostgreSQL reads through a server-side cursor and holds one batch at a time
+
+    Parameters:
+      query (Query): query over plain columns, yield_per does not support eager loading
+      batch_size (int): rows fetched at a time, None loads every row into a list
+
+    Returns:
+      rows (iterable): list of rows, or a query to iterate once when batch_size is given
+    """
+    if batch_size:
+        return query.yield_per(batch_size)
+    return query.all()
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -22,6 +105,10 @@ class Venue(db.Model):
     Model for Venue
     """
     __tablename__ = 'venue'
+    __table_args__ = (db.Index('ix_venue_city_state', 'city', 'state'),
+                      db.Index('ix_venue_state', 'state'),
+                      db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin',
+                               postgresql_ops={'name': 'gin_trgm_ops'}))
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -34,7 +121,10 @@ class Venue(db.Model):
     website_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(200))
-    shows = db.relationship("Show", backref=db.backref('venues', lazy=True))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0') # maintained by count_shows and roll_show_counts
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow) # also touched on genre, show and artist changes, see track_changes
+    shows = db.relationship("Show", backref=db.backref('venues', lazy=True), passive_deletes=True) # shows go with ON DELETE CASCADE, see uncount_cascaded_shows
     genres = db.relationship("VenueGenre", backref=db.backref('venues', lazy=True), passive_deletes=True) # passive_deletes to go with ON DELETE CASCADE, see VenueGenres class
 
     def __init__(self, name, city, state, address, phone, facebook_link,\
@@ -50,34 +140,81 @@ class Venue(db.Model):
       self.seeking_talent = seeking_talent
       self.seeking_description = seeking_description
     
-    def get_shows(self, tense):
+    def get_shows(self, tense, now=None):
       """
-      Iterates through the list of shows related to this venue and gets the future show details using backref
-      tense
+      Gets the future or past shows of this venue along with the artist details. The tense
+      filter and ordering on start_time run in the database and the artist is joined in the
+      same query
 
       Parameters:
         tense (str): denotes whether the details are required for future or past shows
+        now (datetime): reference time, pass the same value for both tenses to get a consistent split
 
       Returns:
         shows(list): shows with details about start_time and artists 
       """
-      shows = []
-      shows_raw = []
+      return self.get_shows_of([self.id], tense, now).get(self.id, [])
+
+    @classmethod
+    def get_shows_of(cls, venue_ids, tense, now=None):
+      """
+      Gets the future or past shows of several venues with one query, see get_shows
+
+      Parameters:
+        venue_ids (list): ids of the venues
+        tense (str): denotes whether the details are required for future or past shows
+        now (datetime): reference time separating upcoming shows from past ones
+
+      Returns:
+        shows (dict): venue id -> shows ordered by start_time, venues without shows are left out
+      """
+      shows = {}
+      try:
+        query = db.session.query(Show.venue_id, Artist.id, Artist.name, Artist.image_link, Show.start_time)\
+                          .join(Show, Show.artist_id == Artist.id)\
+                          .filter(Show.venue_id.in_(venue_ids))
+        query = filter_by_tense(query, tense, now)
+        for venue_id, artist_id, artist_name, artist_image_link, start_time in query.order_by(Show.start_time):
+          shows.setdefault(venue_id, []).append({'artist_id': artist_id,\
+                                                 'artist_name': artist_name,\
+                                                 'artist_image_link': artist_image_link,\
+                                                 'start_time': start_time})
+      except Exception as e:
+        raise e
+      return shows
+
+    @classmethod
+    def get_shows_by_tense(cls, venue_ids, now=None):
+      """
+      Gets the upcoming and the past shows of several venues with one query, split on now in Python
+      instead of running get_shows_of once per tense
+
+      Parameters:
+        venue_ids (list): ids of the venues
+        now (datetime): reference time separating upcoming shows from past ones
+
+      Returns:
+        shows (dict): venue id -> {FUTURE: shows, PAST: shows} ordered by start_time, venues without
+                      shows are left out
+      """
+      now = now or datetime.now()
+      shows = {}
       try:
-        if tense == FUTURE:
-          shows_raw = list(filter(lambda x: x.start_time > datetime.now(), self.shows))
-        elif tense == PAST:
-          shows_raw = list(filter(lambda x: x.start_time < datetime.now(), self.shows))
-        else:
-          raise ValueError("Invalid tense for shows")
-        for show in shows_raw:
-          shows.append({'artist_id': show.artists.id,\
-                        'artist_name': show.artists.name,\
-                        'artist_image_link': show.artists.image_link,\
-                        'start_time': show.start_time.isoformat()})  
+        query = db.session.query(Show.venue_id, Artist.id, Artist.name, Artist.image_link, Show.start_time)\
+                          .join(Show, Show.artist_id == Artist.id)\
+                          .filter(Show.venue_id.in_(venue_ids))
+        for venue_id, artist_id, artist_name, artist_image_link, start_time in query.order_by(Show.start_time):
+          if start_time == now:
+            continue
+          tense = FUTURE if start_time > now else PAST
+          shows.setdefault(venue_id, {FUTURE: [], PAST: []})[tense].append({'artist_id': artist_id,\
+                                                                            'artist_name': artist_name,\
+                                                                            'artist_image_link': artist_image_link,\
+                                                                            'start_time': start_time})
       except Exception as e:
-        raise e      
+        raise e
       return shows
+
       
     
     def get_genres(self):
@@ -86,11 +223,25 @@ class Venue(db.Model):
       """
       genres = []
       try:
-        genres = [genre.name for genre in self.genres]
+        genres = genre_cache.get_names([genre.genre_id for genre in self.genres])
       except Exception as e:
         raise e
       return genres
 
+    @classmethod
+    def get_genres_of(cls, venue_ids):
+      """
+      Gets the genre names of several venues with one query
+
+      Returns:
+        genres (dict): venue id -> genre names, venues without genres are left out
+      """
+      genre_ids = {}
+      for venue_id, genre_id in db.session.query(VenueGenre.venue_id, VenueGenre.genre_id)\
+                                          .filter(VenueGenre.venue_id.in_(venue_ids)):
+        genre_ids.setdefault(venue_id, []).append(genre_id)
+      return {venue_id: genre_cache.get_names(ids) for venue_id, ids in genre_ids.items()}
+
     
     def format_all(self):
       """
@@ -98,8 +249,8 @@ class Venue(db.Model):
       """
       venue_dict = {}
       try:
-        upcoming_shows = self.get_shows(FUTURE)
-        past_shows = self.get_shows(PAST)
+        shows = self.get_shows_by_tense([self.id]).get(self.id, {FUTURE: [], PAST: []})
+        upcoming_shows, past_shows = shows[FUTURE], shows[PAST]
         genres = self.get_genres()
         venue_dict = {
           'id': self.id, 
@@ -123,16 +274,127 @@ class Venue(db.Model):
         raise e
       return venue_dict
 
+    @classmethod
+    def get_version(cls, venue_id, now=None):
+      """
+      Gets what the venue page depends on, to validate conditional requests without loading it:
+      updated_at, which is also touched when the genres, the shows or the artists playing there
+      change, and the start time of the latest show that moved from upcoming to past
+
+      Parameters:
+        venue_id (int): id of the venue
+        now (datetime): reference time separating upcoming shows from past ones
+
+      Returns:
+        version (tuple): (updated_at, last_show_time), None if there is no such venue
+      """
+      now = now or datetime.now()
+      last_show_time = db.session.query(db.func.max(Show.start_time))\
+                                 .filter(Show.venue_id == cls.id, Show.start_time < now)\
+                                 .correlate(cls)\
+                                 .as_scalar()
+      return db.session.query(cls.updated_at, last_show_time).filter(cls.id == venue_id).first()
+
+    @classmethod
+    def load_fields(cls, venue_id, fields):
+      """
+      Loads chosen fields of a venue, named like the keys of format_all, for the pages and API
+      responses that need a few columns rather than the whole venue, see load_fields_of
+
+      Parameters:
+        venue_id (int): id of the venue
+        fields (list): requested fields
+
+      Returns:
+        venue_dict (dict): id and requested fields, None if there is no such venue
+      """
+      records = load_fields_of(cls, fields, cls.id == venue_id)
+      return records[0] if records else None
+
+    @classmethod
+    def load_detail(cls, venue_id):
+      """
+      Loads a venue for its page: the venue from the identity map or by primary key, and its
+      genres with one SELECT ... IN, so that format_all only needs one more query for the shows
+
+      Returns:
+        venue (Venue): venue with its genres loaded, None if there is no such venue
+      """
+      return cls.query.options(db.selectinload(cls.genres)).get(venue_id)
+
+    @classmethod
+    def get_formatted(cls, venue_id, version=None, cached=True):
+      """
+      Gets the output of format_all for a venue, memoized in the entity cache. Entries are evicted
+      by the session events at the end of this module whenever the venue, its genres, its shows or
+      the artists playing there change. Evictions only reach this worker, so entries are also tagged with the
+      version of the venue and only reused for the same version
+
+      Parameters:
+        venue_id (int): id of the venue
+        version (tuple): what the venue page depends on as read for this request, see get_version.
+                         Read from the database when not given
+        cached (bool): False to read past the cache, e.g. from the primary right after a write,
+                       the entry is refreshed
+
+      Returns:
+        venue_dict (dict): formatted venue, None if there is no such venue. The dictionary is
+                           shared between requests and must not be modified
+      """
+      if version is None:
+        version = cls.get_version(venue_id)
+        if version is None:
+          return None
+        version = tuple(version)
+      key = (cls.__tablename__, venue_id)
+      venue_dict = entity_cache.get(key, version) if cached else None
+      if venue_dict is None:
+        venue = cls.load_detail(venue_id)
+        if venue is None:
+          return None
+        venue_dict = venue.format_all()
+        entity_cache.set(key, venue_dict, version=version)
+      return venue_dict
+
+    @classmethod
+    def get_area_rows(cls, filters=None, batch_size=None):
+      """
+      Fetches every venue along with its upcoming show count, read from the upcoming_shows_count
+      column instead of counting shows. Rows are ordered by city and state so that they can be
+      grouped in one pass
+
+      Parameters:
+        filters (dict): genre, state and seeking filters, see filter_by_facets
+        batch_size (int): if given, rows are read lazily in batches of this size through a
+                          server-side cursor instead of loaded into a list, see get_rows_of
+
+      Returns:
+        rows (iterable): (city, state, id, name, num_upcoming_shows) tuples
+      """
+      rows = []
+      try:
+        query = db.session.query(cls.city, cls.state, cls.id, cls.name,\
+                                 cls.upcoming_shows_count.label('num_upcoming_shows'))
+        query = filter_by_facets(query, cls, filters or {})\
+                  .order_by(cls.city, cls.state, cls.id)
+        rows = get_rows_of(query, batch_size)
+      except Exception as e:
+        raise e
+      return rows
+
     def create(self, genres):
       """
       Create a Venue resource and persist to DB
       """
       try:
-        for genre in genres:
-          vg = VenueGenre(name=genre)
+        for genre_id in genre_cache.get_ids(genres, create=True).values():
+          vg = VenueGenre(genre_id=genre_id)
           self.genres.append(vg)
         db.session.add(self)
+        db.session.flush()
+        venue_id, name = self.id, self.name
         db.session.commit()
+        index_name('venue', venue_id, name)
       except Exception as e:
         db.session.rollback()
         raise e
@@ -144,21 +406,68 @@ class Venue(db.Model):
 #------------------------------------------------
 # Show Model
 
+class ShowConflictError(ValueError):
+    """
+    Raised when shows would overlap other shows of their venue
+
+    Attributes:
+      conflicts (list): ((artist_id, start_time) of the new show, (artist_id, start_time) of the
+                        show it overlaps) pairs
+    """
+
+    def __init__(self, conflicts):
+      self.conflicts = conflicts
+      (artist_id, start_time), (other_artist_id, other_start_time) = conflicts[0]
+      message = 'The show at {:%Y-%m-%d %H:%M} overlaps the show of artist {} at {:%Y-%m-%d %H:%M}'\
+                .format(start_time, other_artist_id, other_start_time)
+      if len(conflicts) > 1:
+        message += ', and {} more shows overlap'.format(len(conflicts) - 1)
+      super().__init__(message)
+
+
+def get_end_time(start_time, duration):
+    """
+    Gets the end of a show from its start time and duration in minutes
+    """
+    return start_time + timedelta(minutes=duration)
+
+def check_duration(duration):
+    """
+    Validates a show duration in minutes
+
+    Raises:
+      ValueError: if the duration is not between 1 and MAX_SHOW_DURATION minutes
+    """
+    if not isinstance(duration, int) or isinstance(duration, bool) or not 0 < duration <= MAX_SHOW_DURATION:
+        raise ValueError('The duration must be between 1 and {} minutes'.format(MAX_SHOW_DURATION))
+    return duration
+
+
 class Show(db.Model): 
     """
     Show model associating Venue and Artist model using association object pattern
+
+    A venue holds one show at a time: shows of a venue must not overlap, counting duration minutes
+    from their start time. On PostgreSQL the show_venue_id_excl exclusion constraint enforces it,
+    the creation paths check it beforehand with an IntervalIndex so that conflicts are reported
+    instead of failing the transaction
     """
     __tablename__ = 'show'
+    __table_args__ = (db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+                      db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'))
 
     venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
-    start_time = db.Column(db.DateTime, primary_key=True)
-    artists = db.relationship('Artist', backref=db.backref('shows', lazy=True))
+    start_time = db.Column(db.DateTime, primary_key=True, index=True)
+    duration = db.Column(db.Integer, nullable=False, default=DEFAULT_SHOW_DURATION, server_default=str(DEFAULT_SHOW_DURATION))   # minutes
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    artists = db.relationship('Artist', backref=db.backref('shows', lazy=True, passive_deletes=True))
 
-    def __init__(self, venue_id, artist_id, start_time):
+    def __init__(self, venue_id, artist_id, start_time, duration=DEFAULT_SHOW_DURATION):
       self.venue_id = venue_id
       self.artist_id = artist_id
       self.start_time = start_time
+      self.duration = duration
       
     def get_show_dict(self):
       """
@@ -172,24 +481,183 @@ class Show(db.Model):
           "artist_id": self.artist_id,
           "artist_name": self.artists.name,
           "artist_image_link": self.artists.image_link,
-          "start_time": self.start_time.isoformat() 
+          "start_time": self.start_time
         }
       except Exception as e:
         raise e
       return show_dict
 
+    @classmethod
+    def get_listing(cls, batch_size=None):
+      """
+      Fetches the rows needed by the shows page, joining venue and artist once
+      and selecting only the columns the template renders
+
+      Parameters:
+        batch_size (int): if given, rows are read lazily in batches of this size through a
+                          server-side cursor instead of loaded into a list, see get_rows_of
+
+      Returns:
+        shows (iterable): lightweight rows with venue_id, venue_name, artist_id, artist_name,
+                          artist_image_link and start_time attributes
+      """
+      shows = []
+      try:
+        query = db.session.query(cls.venue_id,\
+                                 Venue.name.label('venue_name'),\
+                                 cls.artist_id,\
+                                 Artist.name.label('artist_name'),\
+                                 Artist.image_link.label('artist_image_link'),\
+                                 cls.start_time)\
+                          .join(Venue, Venue.id == cls.venue_id)\
+                          .join(Artist, Artist.id == cls.artist_id)\
+                          .order_by(cls.start_time)
+        shows = get_rows_of(query, batch_size)
+      except Exception as e:
+        raise e
+      return shows
+
+    @classmethod
+    def get_bookings(cls, venue_ids, start, end):
+      """
+      Loads the shows of venues that may overlap [start, end) with one range scan of
+      ix_show_venue_id_start_time. Shows starting up to MAX_SHOW_DURATION minutes before start
+      are included since they can still be running
+
+      Parameters:
+        venue_ids (iterable): ids of the venues
+        start (datetime): start of the period
+        end (datetime): end of the period
+
+      Returns:
+        bookings (dict): venue id -> list of (start time, end time, (artist_id, start_time))
+                         intervals, to build an IntervalIndex from
+      """
+      bookings = {venue_id: [] for venue_id in venue_ids}
+      rows = db.session.query(cls.venue_id, cls.artist_id, cls.start_time, cls.duration)\
+                       .filter(cls.venue_id.in_(bookings),\
+                               cls.start_time > start - timedelta(minutes=MAX_SHOW_DURATION),\
+                               cls.start_time < end)
+      for venue_id, artist_id, start_time, duration in rows:
+        bookings[venue_id].append((start_time, get_end_time(start_time, duration), (artist_id, start_time)))
+      return bookings
+
+    @classmethod
+    def lock_venues(cls, venue_ids):
+      """
+      Locks the rows of venues until the end of the transaction, so that the shows checked by
+      get_bookings cannot change before the new shows are inserted. Locks are taken in id order
+      to keep concurrent writers from deadlocking, other databases serialize writes anyway
+
+      Returns:
+        venue_ids (set): ids of the venues that exist
+      """
+      return set(venue_id for venue_id, in db.session.query(Venue.id)\
+                                                   .filter(Venue.id.in_(venue_ids))\
+                                                   .order_by(Venue.id)\
+                                                   .with_for_update())
+
     def create(self):
       """
       Creates a show and persists to DB
+
+      Raises:
+        ShowConflictError: if the show overlaps another show of the venue
       """
       try:
+        check_duration(self.duration)
+        self.lock_venues([self.venue_id])
+        end_time = get_end_time(self.start_time, self.duration)
+        bookings = IntervalIndex(self.get_bookings([self.venue_id], self.start_time, end_time)[self.venue_id])
+        conflict = bookings.find_overlap(self.start_time, end_time)
+        if conflict is not None:
+          raise ShowConflictError([((self.artist_id, self.start_time), conflict)])
         db.session.add(self)
         db.session.commit()
+      except exc.IntegrityError as e:
+        db.session.rollback()
+        # a show added concurrently by a writer that did not lock the venue
+        if getattr(e.orig, 'pgcode', None) == EXCLUSION_VIOLATION:
+          raise ShowConflictError([((self.artist_id, self.start_time), (None, self.start_time))])
+        raise e
+      except Exception as e:
+        db.session.rollback()
+        raise e
+      finally:
+        db.session.close()
+
+    @classmethod
+    def create_batch(cls, venue_id, artist_id, start_times, duration=DEFAULT_SHOW_DURATION):
+      """
+      Creates many shows of one venue and artist, e.g. the occurrences of a residency, with one
+      range query for the shows of the venue around them and a single multi-row INSERT. Overlaps
+      are found with an IntervalIndex, in O(log n) per show. The batch is all or nothing
+
+      Parameters:
+        venue_id (int): id of the venue
+        artist_id (int): id of the artist
+        start_times (list): start times of the shows
+        duration (int): duration of every show, in minutes
+
+      Returns:
+        result (dict): 'created' and 'duplicates', the start times inserted and the start times
+                       skipped because the show already exists or is repeated in start_times
+
+      Raises:
+        ValueError: if there is no such venue or artist, or the duration is invalid
+        ShowConflictError: if shows overlap other shows of the venue or each other, or a show of
+                           the batch was added meanwhile by a writer that did not lock the venue,
+                           nothing is created then
+      """
+      result = {'created': [], 'duplicates': []}
+      try:
+        check_duration(duration)
+        if not cls.lock_venues([venue_id]):
+          raise ValueError('No venue with id {}'.format(venue_id))
+        if db.session.query(Artist.id).filter(Artist.id == artist_id).first() is None:
+          raise ValueError('No artist with id {}'.format(artist_id))
+        start_times = sorted(start_times)
+        if not start_times:
+          return result
+        bookings = cls.get_bookings([venue_id], start_times[0], get_end_time(start_times[-1], duration))[venue_id]
+        existing = set(item for start_time, end_time, item in bookings if item[0] == artist_id)
+        shows = []
+        for start_time in start_times:
+          if (artist_id, start_time) in existing:
+            result['duplicates'].append(start_time)
+          else:
+            existing.add((artist_id, start_time))
+            shows.append((start_time, get_end_time(start_time, duration), (artist_id, start_time)))
+        accepted, conflicts = check_intervals(IntervalIndex(bookings), shows)
+        if conflicts:
+          raise ShowConflictError(conflicts)
+        result['created'] = [start_time for start_time, end_time, item in accepted]
+        if result['created']:
+          now = datetime.utcnow()
+          # a plain INSERT: every row is inserted or the batch fails, so that the shows reported
+          # as created and counted by count_shows are the ones in the table
+          db.session.execute(cls.__table__.insert().values([{'venue_id': venue_id, 'artist_id': artist_id,\
+                                                             'start_time': start_time, 'duration': duration,\
+                                                             'updated_at': now}\
+                                                            for start_time in result['created']]))
+          count_shows(db.session, [(venue_id, artist_id, start_time) for start_time in result['created']])
+          record_changes(db.session, [venue_id], [artist_id], [cls.__tablename__], now)
+        db.session.commit()
+      except exc.IntegrityError as e:
+        db.session.rollback()
+        # the venue is locked, so only a writer that did not lock it can have added a show
+        # meanwhile, either the same show or one overlapping the batch. Read it to report it
+        if getattr(e.orig, 'pgcode', None) not in (EXCLUSION_VIOLATION, UNIQUE_VIOLATION):
+          raise e
+        bookings = cls.get_bookings([venue_id], start_times[0], get_end_time(start_times[-1], duration))[venue_id]
+        accepted, conflicts = check_intervals(IntervalIndex(bookings), accepted)
+        raise ShowConflictError(conflicts or [((artist_id, accepted[0][0]), (None, accepted[0][0]))])
       except Exception as e:
         db.session.rollback()
         raise e
       finally:
         db.session.close()
+      return result
 
 
 #------------------------------------------------
@@ -201,6 +669,9 @@ class Artist(db.Model):
     """
     
     __tablename__ = 'artist'
+    __table_args__ = (db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin',
+                               postgresql_ops={'name': 'gin_trgm_ops'}),
+                      db.Index('ix_artist_state', 'state'))
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -212,6 +683,9 @@ class Artist(db.Model):
     website_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(200))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0') # maintained by count_shows and roll_show_counts
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow) # also touched on genre, show and venue changes, see track_changes
     genres = db.relationship("ArtistGenre", backref=db.backref('artists', lazy=True), passive_deletes=True)
 
     def __init__(self, name, city, state, phone, facebook_link,\
@@ -226,34 +700,81 @@ class Artist(db.Model):
       self.seeking_venue = seeking_venue
       self.seeking_description = seeking_description
 
-    def get_shows(self, tense):
+    def get_shows(self, tense, now=None):
       """
-      Iterates through the list of shows related to this venue and gets the future show details using backref
-      tense
+      Gets the future or past shows of this artist along with the venue details. The tense
+      filter and ordering on start_time run in the database and the venue is joined in the
+      same query
 
       Parameters:
         tense (str): denotes whether the details are required for future or past shows
+        now (datetime): reference time, pass the same value for both tenses to get a consistent split
 
       Returns:
         shows(list): shows with details about start_time and venues
       """
-      shows = []
-      shows_raw = []
+      return self.get_shows_of([self.id], tense, now).get(self.id, [])
+
+    @classmethod
+    def get_shows_of(cls, artist_ids, tense, now=None):
+      """
+      Gets the future or past shows of several artists with one query, see get_shows
+
+      Parameters:
+        artist_ids (list): ids of the artists
+        tense (str): denotes whether the details are required for future or past shows
+        now (datetime): reference time separating upcoming shows from past ones
+
+      Returns:
+        shows (dict): artist id -> shows ordered by start_time, artists without shows are left out
+      """
+      shows = {}
       try:
-        if tense == FUTURE:
-          shows_raw = list(filter(lambda x: x.start_time > datetime.now(), self.shows))
-        elif tense == PAST:
-          shows_raw = list(filter(lambda x: x.start_time < datetime.now(), self.shows))
-        else:
-          raise ValueError("Invalid tense for shows")
-        for show in shows_raw:
-          shows.append({'venue_id': show.venues.id,\
-                        'venue_name': show.venues.name,\
-                        'venue_image_link': show.venues.image_link,\
-                        'start_time': show.start_time.isoformat()})  
+        query = db.session.query(Show.artist_id, Venue.id, Venue.name, Venue.image_link, Show.start_time)\
+                          .join(Show, Show.venue_id == Venue.id)\
+                          .filter(Show.artist_id.in_(artist_ids))
+        query = filter_by_tense(query, tense, now)
+        for artist_id, venue_id, venue_name, venue_image_link, start_time in query.order_by(Show.start_time):
+          shows.setdefault(artist_id, []).append({'venue_id': venue_id,\
+                                                  'venue_name': venue_name,\
+                                                  'venue_image_link': venue_image_link,\
+                                                  'start_time': start_time})
       except Exception as e:
-        raise e      
-      return shows 
+        raise e
+      return shows
+
+    @classmethod
+    def get_shows_by_tense(cls, artist_ids, now=None):
+      """
+      Gets the upcoming and the past shows of several artists with one query, split on now in Python
+      instead of running get_shows_of once per tense
+
+      Parameters:
+        artist_ids (list): ids of the artists
+        now (datetime): reference time separating upcoming shows from past ones
+
+      Returns:
+        shows (dict): artist id -> {FUTURE: shows, PAST: shows} ordered by start_time, artists without
+                      shows are left out
+      """
+      now = now or datetime.now()
+      shows = {}
+      try:
+        query = db.session.query(Show.artist_id, Venue.id, Venue.name, Venue.image_link, Show.start_time)\
+                          .join(Show, Show.venue_id == Venue.id)\
+                          .filter(Show.artist_id.in_(artist_ids))
+        for artist_id, venue_id, venue_name, venue_image_link, start_time in query.order_by(Show.start_time):
+          if start_time == now:
+            continue
+          tense = FUTURE if start_time > now else PAST
+          shows.setdefault(artist_id, {FUTURE: [], PAST: []})[tense].append({'venue_id': venue_id,\
+                                                                             'venue_name': venue_name,\
+                                                                             'venue_image_link': venue_image_link,\
+                                                                             'start_time': start_time})
+      except Exception as e:
+        raise e
+      return shows
+
 
   
     def get_genres(self):
@@ -262,18 +783,33 @@ class Artist(db.Model):
       """
       genres = []
       try:
-        genres = [genre.name for genre in self.genres]
+        genres = genre_cache.get_names([genre.genre_id for genre in self.genres])
       except Exception as e:
         raise e
       return genres 
 
+    @classmethod
+    def get_genres_of(cls, artist_ids):
+      """
+      Gets the genre names of several artists with one query
+
+      Returns:
+        genres (dict): artist id -> genre names, artists without genres are left out
+      """
+      genre_ids = {}
+      for artist_id, genre_id in db.session.query(ArtistGenre.artist_id, ArtistGenre.genre_id)\
+                                           .filter(ArtistGenre.artist_id.in_(artist_ids)):
+        genre_ids.setdefault(artist_id, []).append(genre_id)
+      return {artist_id: genre_cache.get_names(ids) for artist_id, ids in genre_ids.items()}
+
     def format_all(self):
       """
       Format or prepare data as per the requirement
       """
       artist_dict = {}
       try:
-        upcoming_shows, past_shows = self.get_shows(FUTURE), self.get_shows(PAST)
+        shows = self.get_shows_by_tense([self.id]).get(self.id, {FUTURE: [], PAST: []})
+        upcoming_shows, past_shows = shows[FUTURE], shows[PAST]
         genres = self.get_genres()
         artist_dict = {
           'id': self.id, 
@@ -296,40 +832,697 @@ class Artist(db.Model):
         raise e
       return artist_dict
 
+    @classmethod
+    def get_rows(cls, filters=None, batch_size=None):
+      """
+      Fetches the id and name of the artists matching the filters, ordered by id
+
+      Parameters:
+        filters (dict): genre, state and seeking filters, see filter_by_facets
+        batch_size (int): if given, rows are read lazily in batches of this size through a
+                          server-side cursor instead of loaded into a list, see get_rows_of
+
+      Returns:
+        rows (iterable): (id, name) tuples
+      """
+      query = db.session.query(cls.id, cls.name)
+      return get_rows_of(filter_by_facets(query, cls, filters or {}).order_by(cls.id), batch_size)
+
+    @classmethod
+    def get_version(cls, artist_id, now=None):
+      """
+      Gets what the artist page depends on, to validate conditional requests without loading it:
+      updated_at, which is also touched when the genres, the shows or the venues it plays at
+      change, and the start time of the latest show that moved from upcoming to past
+
+      Parameters:
+        artist_id (int): id of the artist
+        now (datetime): reference time separating upcoming shows from past ones
+
+      Returns:
+        version (tuple): (updated_at, last_show_time), None if there is no such artist
+      """
+      now = now or datetime.now()
+      last_show_time = db.session.query(db.func.max(Show.start_time))\
+                                 .filter(Show.artist_id == cls.id, Show.start_time < now)\
+                                 .correlate(cls)\
+                                 .as_scalar()
+      return db.session.query(cls.updated_at, last_show_time).filter(cls.id == artist_id).first()
+
+    @classmethod
+    def load_fields(cls, artist_id, fields):
+      """
+      Loads chosen fields of a artist, named like the keys of format_all, for the pages and API
+      responses that need a few columns rather than the whole artist, see load_fields_of
+
+      Parameters:
+        artist_id (int): id of the artist
+        fields (list): requested fields
+
+      Returns:
+        artist_dict (dict): id and requested fields, None if there is no such artist
+      """
+      records = load_fields_of(cls, fields, cls.id == artist_id)
+      return records[0] if records else None
+
+    @classmethod
+    def load_detail(cls, artist_id):
+      """
+      Loads a artist for its page: the artist from the identity map or by primary key, and its
+      genres with one SELECT ... IN, so that format_all only needs one more query for the shows
+
+      Returns:
+        artist (Artist): artist with its genres loaded, None if there is no such artist
+      """
+      return cls.query.options(db.selectinload(cls.genres)).get(artist_id)
+
+    @classmethod
+    def get_formatted(cls, artist_id, version=None, cached=True):
+      """
+      Gets the output of format_all for an artist, memoized in the entity cache. Entries are evicted
+      by the session events at the end of this module whenever the artist, its genres, its shows or
+      the venues it plays at change. Evictions only reach this worker, so entries are also tagged with the
+      version of the artist and only reused for the same version
+
+      Parameters:
+        artist_id (int): id of the artist
+        version (tuple): what the artist page depends on as read for this request, see get_version.
+                         Read from the database when not given
+        cached (bool): False to read past the cache, e.g. from the primary right after a write,
+                       the entry is refreshed
+
+      Returns:
+        artist_dict (dict): formatted artist, None if there is no such artist. The dictionary is
+                            shared between requests and must not be modified
+      """
+      if version is None:
+        version = cls.get_version(artist_id)
+        if version is None:
+          return None
+        version = tuple(version)
+      key = (cls.__tablename__, artist_id)
+      artist_dict = entity_cache.get(key, version) if cached else None
+      if artist_dict is None:
+        artist = cls.load_detail(artist_id)
+        if artist is None:
+          return None
+        artist_dict = artist.format_all()
+        entity_cache.set(key, artist_dict, version=version)
+      return artist_dict
+
     def create(self, genres):
       """
       Create resource for artist and persist
       """
       try:
-        for genre in genres:
-          ag = ArtistGenre(name=genre)
+        for genre_id in genre_cache.get_ids(genres, create=True).values():
+          ag = ArtistGenre(genre_id=genre_id)
           self.genres.append(ag)
         db.session.add(self)
+        db.session.flush()
+        artist_id, name = self.id, self.name
         db.session.commit()
+        index_name('artist', artist_id, name)
       except Exception as e:
         db.session.rollback()
         raise e
       finally:
         db.session.close()
 
+# the trigram indexes on venue.name and artist.name need pg_trgm, other databases get a plain index
+for table in (Venue.__table__, Artist.__table__):
+  event.listen(table, 'before_create',
+               DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+# shows of a venue must not overlap. Integer equality in a GiST index needs btree_gist
+EXCLUSION_VIOLATION = '23P01'
+UNIQUE_VIOLATION = '23505'
+event.listen(Show.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+event.listen(Show.__table__, 'after_create',
+             DDL("ALTER TABLE show ADD CONSTRAINT show_venue_id_excl EXCLUDE USING gist "
+                 "(venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)")\
+             .execute_if(dialect='postgresql'))
+
+#------------------------------------------------
+# Genre Model
+class Genre(db.Model):
+    """
+    Genre names, referenced by venues and artists through small integer ids. Genres are only ever
+    added, never renamed or deleted, which lets genre_cache keep them for the life of the process
+    """
+    __tablename__ = 'genre'
+    # SQLite only generates keys for INTEGER primary keys
+    id = db.Column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    name = db.Column(db.String(30), nullable=False, unique=True)
+
 #------------------------------------------------
 # VenueGenre Model
 class VenueGenre(db.Model):
     """
-    VenueGenres model stores genres for Venues. This was necessary to maintain first normal form. The relationship between Venue and Genre has been modelled as a one to many relationship   
+    VenueGenre associates venues with genres, modelling the many to many relationship between Venue and Genre
     """
-    # TODO: Model the relationship between Venue and Genre as a many to many relationship
     __tablename__ = 'venuegenre'
     venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True) # ondelete='CASCADE' preferred over ORM based delete cascade as this is native to db
-    name = db.Column(db.String(30), nullable=False, primary_key=True)
+    genre_id = db.Column(db.SmallInteger, db.ForeignKey('genre.id'), primary_key=True, index=True)
 
 #------------------------------------------------
 # ArtistGenre Model
 class ArtistGenre(db.Model):
     """
-    ArtistGenres model stores genres for Artists. This was necessary to maintain first normal form. The relationship between Aritist and Genre has been modelled as a one to many relationship   
+    ArtistGenre associates artists with genres, modelling the many to many relationship between Artist and Genre
     """
-    # TODO: Model the relationship between Artist and Genre as a many to many relationship
     __tablename__ = 'artistgenre'
     artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
-    name = db.Column(db.String(30), nullable=False, primary_key=True)
+    genre_id = db.Column(db.SmallInteger, db.ForeignKey('genre.id'), primary_key=True, index=True)
+
+#------------------------------------------------
+# TableVersion Model
+class TableVersion(db.Model):
+    """
+    Version counter per table, bumped by every flush that writes to it. Lets the listing pages
+    validate conditional requests with a primary key lookup instead of scanning the table
+    """
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def get_versions(cls, names):
+      """
+      Gets the version rows of the given tables
+
+      Returns:
+        versions (list): (name, version, updated_at) rows ordered by name
+      """
+      return db.session.query(cls.name, cls.version, cls.updated_at)\
+                       .filter(cls.name.in_(names))\
+                       .order_by(cls.name)\
+                       .all()
+
+VERSIONED_TABLES = ('venue', 'artist', 'show')
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def create_table_versions(target, connection, **kw):
+    connection.execute(target.insert(), [{'name': name, 'version': 0, 'updated_at': datetime.utcnow()}\
+                                         for name in VERSIONED_TABLES])
+
+#------------------------------------------------
+# ShowCountWatermark Model
+class ShowCountWatermark(db.Model):
+    """
+    Single row holding the time up to which shows are counted as past in the show counters of
+    venues and artists. Shows starting later count as upcoming until roll_show_counts moves the
+    watermark past them
+    """
+    __tablename__ = 'show_count_watermark'
+    id = db.Column(db.Integer, primary_key=True)
+    counted_until = db.Column(db.DateTime, nullable=False)
+
+@event.listens_for(ShowCountWatermark.__table__, 'after_create')
+def create_show_count_watermark(target, connection, **kw):
+    # start times are stored in local time
+    connection.execute(target.insert(), {'id': 1, 'counted_until': datetime.now()})
+
+#----------------------------------------------------------------------------#
+# Field selective loading.
+#----------------------------------------------------------------------------#
+
+# fields of venues and artists read from a column, named like the keys of format_all. Show counts
+# are the maintained counters, current as of the last roll_show_counts run
+VENUE_COLUMNS = {
+  'id': Venue.id,
+  'name': Venue.name,
+  'address': Venue.address,
+  'city': Venue.city,
+  'state': Venue.state,
+  'phone': Venue.phone,
+  'website': Venue.website_link,
+  'facebook_link': Venue.facebook_link,
+  'seeking_talent': Venue.seeking_talent,
+  'seeking_description': Venue.seeking_description,
+  'image_link': Venue.image_link,
+  'upcoming_shows_count': Venue.upcoming_shows_count,
+  'past_shows_count': Venue.past_shows_count
+}
+ARTIST_COLUMNS = {
+  'id': Artist.id,
+  'name': Artist.name,
+  'city': Artist.city,
+  'state': Artist.state,
+  'phone': Artist.phone,
+  'website': Artist.website_link,
+  'facebook_link': Artist.facebook_link,
+  'seeking_venue': Artist.seeking_venue,
+  'seeking_description': Artist.seeking_description,
+  'image_link': Artist.image_link,
+  'upcoming_shows_count': Artist.upcoming_shows_count,
+  'past_shows_count': Artist.past_shows_count
+}
+# fields loaded with one extra query for all the rows, and only when requested
+RELATION_FIELDS = ('genres', 'upcoming_shows', 'past_shows')
+
+
+def load_fields_of(model, fields, query_filter, limit=None, filters=None):
+    """
+    Loads venues or artists with only the requested fields, without building model instances or
+    touching their relationships: one query selecting the requested columns and one batched query
+    for the genres and for the shows if requested, whatever the number of rows
+
+    Parameters:
+      model (Venue|Artist): model to load
+      fields (list): requested fields, keys of VENUE_COLUMNS or ARTIST_COLUMNS and RELATION_FIELDS
+      query_filter (ClauseElement): rows to load
+      limit (int): maximum number of rows, rows are ordered by id
+      filters (dict): genre, state and seeking filters, see filter_by_facets
+
+    Returns:
+      records (list): dictionaries with the id and the requested fields
+
+    Raises:
+      ValueError: if a field is unknown
+    """
+    columns = VENUE_COLUMNS if model is Venue else ARTIST_COLUMNS
+    unknown = [field for field in fields if field not in columns and field not in RELATION_FIELDS]
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+    selected = ['id'] + [field for field in fields if field in columns and field != 'id']
+    query = db.session.query(*[columns[field].label(field) for field in selected])\
+                      .filter(query_filter)
+    query = filter_by_facets(query, model, filters or {}).order_by(model.id)
+    rows = query.limit(limit).all() if limit else query.all()
+    records = [row._asdict() for row in rows]
+    ids = [record['id'] for record in records]
+    if not ids:
+        return records
+    if 'genres' in fields:
+        genres = model.get_genres_of(ids)
+        for record in records:
+            record['genres'] = genres.get(record['id'], [])
+    if 'upcoming_shows' in fields or 'past_shows' in fields:
+        shows = model.get_shows_by_tense(ids)
+        for tense, field in ((FUTURE, 'upcoming_shows'), (PAST, 'past_shows')):
+            if field in fields:
+                for record in records:
+                    record[field] = shows.get(record['id'], {tense: []})[tense]
+    return records
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+def get_count_watermark(session, for_update=False):
+    """
+    Reads the time up to which shows are counted as past. Writers counting shows share a lock on
+    the row and roll_show_counts takes it exclusively, so the watermark cannot move between the
+    moment a show is counted and the commit of its transaction
+    """
+    return session.query(ShowCountWatermark.counted_until)\
+                  .filter(ShowCountWatermark.id == 1)\
+                  .with_for_update(read=not for_update)\
+                  .scalar()
+
+def add_show_counts(session, model, counts):
+    """
+    Adds to the show counters of venues or artists with a single executemany UPDATE
+
+    Parameters:
+      session (Session): session of the transaction
+      model (Venue|Artist): model whose counters change
+      counts (dict): id -> (upcoming shows to add, past shows to add), negative to subtract
+    """
+    counts = {entity_id: count for entity_id, count in counts.items() if count != (0, 0)}
+    if counts:
+      table = model.__table__
+      session.execute(table.update()\
+                           .where(table.c.id == db.bindparam('entity_id'))\
+                           .values(upcoming_shows_count=table.c.upcoming_shows_count + db.bindparam('upcoming'),\
+                                   past_shows_count=table.c.past_shows_count + db.bindparam('past')),\
+                      [{'entity_id': entity_id, 'upcoming': upcoming, 'past': past}\
+                       for entity_id, (upcoming, past) in counts.items()])
+
+def count_shows(session, shows, sign=1):
+    """
+    Maintains the show counters of venues and artists in the transaction that inserts or deletes
+    shows. Shows after the watermark count as upcoming, the others as past. The ORM calls it from
+    the flush events, Core inserts such as Show.create_batch and the importer call it directly
+
+    Parameters:
+      session (Session): session of the transaction
+      shows (iterable): (venue_id, artist_id, start_time) of the shows
+      sign (int): 1 for inserted shows, -1 for deleted ones
+    """
+    shows = list(shows)
+    if not shows:
+      return
+    watermark = get_count_watermark(session)
+    venue_counts, artist_counts = {}, {}
+    for venue_id, artist_id, start_time in shows:
+      upcoming, past = (sign, 0) if start_time > watermark else (0, sign)
+      for counts, entity_id in ((venue_counts, venue_id), (artist_counts, artist_id)):
+        count = counts.get(entity_id, (0, 0))
+        counts[entity_id] = (count[0] + upcoming, count[1] + past)
+    add_show_counts(session, Venue, venue_counts)
+    add_show_counts(session, Artist, artist_counts)
+    # /venues lists the upcoming counts
+    bump_table_versions(session, [Venue.__tablename__])
+
+def roll_show_counts(now=None):
+    """
+    Moves the shows that started since the last run from the upcoming to the past counters, with
+    one grouped query and one UPDATE per model, and advances the watermark. Meant to run every few
+    minutes, see `flask roll-show-counts`: until then the shows that started since the watermark
+    still count as upcoming
+
+    Parameters:
+      now (datetime): new watermark, defaults to the current time
+
+    Returns:
+      rolled (int): number of shows moved to the past counters
+    """
+    rolled = 0
+    try:
+      now = now or datetime.now()
+      watermark = get_count_watermark(db.session, for_update=True)
+      if now > watermark:
+        for model, show_column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+          rows = db.session.query(show_column, db.func.count())\
+                           .filter(Show.start_time > watermark, Show.start_time <= now)\
+                           .group_by(show_column)\
+                           .all()
+          add_show_counts(db.session, model, {entity_id: (-count, count) for entity_id, count in rows})
+          rolled = sum(count for entity_id, count in rows)
+        db.session.execute(ShowCountWatermark.__table__.update().values(counted_until=now))
+        if rolled:
+          bump_table_versions(db.session, [Venue.__tablename__])
+      db.session.commit()
+    except Exception as e:
+      db.session.rollback()
+      raise e
+    finally:
+      db.session.close()
+    return rolled
+
+def rebuild_show_counts(now=None):
+    """
+    Recounts the shows of every venue and artist and resets the watermark, to repair counters
+    changed by writes that bypassed count_shows
+
+    Parameters:
+      now (datetime): new watermark, defaults to the current time
+    """
+    try:
+      now = now or datetime.now()
+      get_count_watermark(db.session, for_update=True)
+      for model, show_column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        shows = db.session.query(db.func.count(Show.start_time))\
+                          .filter(show_column == model.__table__.c.id)\
+                          .correlate(model.__table__)
+        db.session.execute(model.__table__.update()\
+                                          .values(upcoming_shows_count=shows.filter(Show.start_time > now).as_scalar(),\
+                                                  past_shows_count=shows.filter(Show.start_time <= now).as_scalar()))
+      db.session.execute(ShowCountWatermark.__table__.update().values(counted_until=now))
+      bump_table_versions(db.session, [Venue.__tablename__])
+      db.session.commit()
+    except Exception as e:
+      db.session.rollback()
+      raise e
+    finally:
+      db.session.close()
+
+#----------------------------------------------------------------------------#
+# Genre cache.
+#----------------------------------------------------------------------------#
+
+def insert_ignoring_conflicts(table, dialect):
+    """
+    Builds an INSERT that skips rows violating a unique constraint instead of failing
+    """
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    return table.insert()
+
+
+class GenreCache:
+    """
+    Process-wide map between genre names and ids, so that genres are handled as small integers and
+    their names are not read back with every venue or artist.
+
+    Only committed genres are cached: genres created by a transaction are kept in its session and
+    added when it commits, so a rollback cannot leave an id in the cache that does not exist.
+    """
+
+    def __init__(self):
+      self.ids = {}     # name -> id
+      self.names = {}   # id -> name
+      self.lock = threading.Lock()
+
+    def add(self, rows):
+      with self.lock:
+        for genre_id, name in rows:
+          self.ids[name] = genre_id
+          self.names[genre_id] = name
+
+    def clear(self):
+      with self.lock:
+        self.ids.clear()
+        self.names.clear()
+
+    def get_ids(self, names, create=False):
+      """
+      Resolves genre names to ids, reading the names missing from the cache with one query
+
+      Parameters:
+        names (list): genre names
+        create (bool): insert the genres that do not exist yet
+
+      Returns:
+        ids (dict): name -> id in the order of names, unknown names are left out unless created
+      """
+      names = list(dict.fromkeys(names))
+      missing = [name for name in names if name not in self.ids]
+      resolved = {}
+      if missing:
+        resolved = dict((name, genre_id) for genre_id, name in db.session.query(Genre.id, Genre.name)\
+                                                                         .filter(Genre.name.in_(missing)))
+        created = [name for name in missing if name not in resolved]
+        if created and create:
+          db.session.execute(insert_ignoring_conflicts(Genre.__table__, db.engine.dialect.name),\
+                             [{'name': name} for name in created])
+          created_ids = dict((name, genre_id) for genre_id, name in db.session.query(Genre.id, Genre.name)\
+                                                                              .filter(Genre.name.in_(created)))
+          # cached once the transaction commits, see cache_committed_genres
+          db.session.info.setdefault('pending_genres', {}).update(created_ids)
+          resolved.update(created_ids)
+        self.add_committed((genre_id, name) for name, genre_id in resolved.items())
+      return dict((name, self.ids.get(name, resolved.get(name))) for name in names\
+                  if name in self.ids or name in resolved)
+
+    def get_names(self, ids):
+      """
+      Gets the names of genre ids, reading the ids missing from the cache with one query
+      """
+      missing = [genre_id for genre_id in ids if genre_id not in self.names]
+      resolved = {}
+      if missing:
+        resolved = dict(db.session.query(Genre.id, Genre.name).filter(Genre.id.in_(missing)))
+        self.add_committed(resolved.items())
+      return [self.names.get(genre_id, resolved.get(genre_id)) for genre_id in ids]
+
+    def add_committed(self, rows):
+      """
+      Caches (id, name) rows read from the genre table, except the genres created by the current
+      transaction which are cached when it commits
+      """
+      pending = db.session.info.get('pending_genres', {})
+      self.add([(genre_id, name) for genre_id, name in rows if name not in pending])
+
+
+genre_cache = GenreCache()
+
+
+def sync_genres(model, entity_id, names):
+    """
+    Replaces the genres of a venue or artist with one DELETE of the genres missing from names and
+    one multi-row INSERT of names that skips the genres it already has. The genres relationship is
+    not loaded, and since Core statements bypass the flush events the change is reported through
+    record_changes
+
+    Parameters:
+      model (Venue|Artist): model of the entity
+      entity_id (int): id of the venue or artist
+      names (list): genre names the entity should have
+    """
+    genre_model, owner_column, seeking_column = get_facet_columns(model)
+    genre_ids = list(genre_cache.get_ids(names, create=True).values())
+    delete = genre_model.__table__.delete().where(owner_column == entity_id)
+    if genre_ids:
+        delete = delete.where(genre_model.genre_id.notin_(genre_ids))
+    db.session.execute(delete)
+    if genre_ids:
+        insert = insert_ignoring_conflicts(genre_model.__table__, db.engine.dialect.name)
+        db.session.execute(insert.values([{owner_column.key: entity_id, 'genre_id': genre_id} for genre_id in genre_ids]))
+    if model is Venue:
+        record_changes(db.session, [entity_id], [], [Venue.__tablename__])
+    else:
+        record_changes(db.session, [], [entity_id], [Artist.__tablename__])
+
+#----------------------------------------------------------------------------#
+# Change tracking.
+#----------------------------------------------------------------------------#
+
+# attributes of a venue or artist that are rendered on the pages of the counterpart entity
+COUNTERPART_FIELDS = ('name', 'image_link')
+
+
+def get_attribute_values(instance, attribute):
+    """
+    Gets the current and, if it was changed in this flush, the previous value of an attribute
+    """
+    history = inspect(instance).attrs[attribute].history
+    return [value for value in history.sum() if value is not None]
+
+
+def has_counterpart_changes(session, instance):
+    """
+    Tells whether a pending change to a venue or artist shows on the pages of its counterparts
+    """
+    state = inspect(instance)
+    return instance in session.deleted or\
+           any(state.attrs[field].history.has_changes() for field in COUNTERPART_FIELDS)
+
+
+def get_counterpart_ids(session, instance):
+    """
+    Gets the ids of the artists playing at a venue, or of the venues an artist plays at
+    """
+    if isinstance(instance, Venue):
+      counterparts = session.query(Show.artist_id).filter(Show.venue_id == instance.id).distinct()
+    else:
+      counterparts = session.query(Show.venue_id).filter(Show.artist_id == instance.id).distinct()
+    return [counterpart_id for counterpart_id, in counterparts]
+
+
+def evict_entities(session, keys):
+    """
+    Schedules entity cache keys for eviction when the session commits. Core statements such as bulk
+    inserts and deletes bypass the flush events and report the entities they touch through here
+    """
+    session.info.setdefault('evicted_entities', set()).update(keys)
+
+
+def touch(session, model, ids, now=None):
+    """
+    Sets updated_at of the given venues or artists with a single UPDATE
+    """
+    if ids:
+      session.execute(model.__table__.update()\
+                                     .where(model.id.in_(ids))\
+                                     .values(updated_at=now or datetime.utcnow()))
+
+
+def bump_table_versions(session, names, now=None):
+    """
+    Increments the version of the given tables. Core statements that bypass the flush events call
+    this directly
+    """
+    if names:
+      session.execute(TableVersion.__table__.update()\
+                                            .where(TableVersion.name.in_(names))\
+                                            .values(version=TableVersion.version + 1,\
+                                                    updated_at=now or datetime.utcnow()))
+
+
+def record_changes(session, venue_ids, artist_ids, tables, now=None):
+    """
+    Records changes to venues and artists made outside the unit of work: touches their updated_at,
+    bumps the table versions and schedules the entity cache evictions, including the facet counts
+    of the venue and artist tables listed in tables
+    """
+    now = now or datetime.utcnow()
+    touch(session, Venue, venue_ids, now)
+    touch(session, Artist, artist_ids, now)
+    bump_table_versions(session, tables, now)
+    evict_entities(session, [(Venue.__tablename__, venue_id) for venue_id in venue_ids] +\
+                            [(Artist.__tablename__, artist_id) for artist_id in artist_ids] +\
+                            [('facets', table) for table in tables if table in (Venue.__tablename__, Artist.__tablename__)])
+
+
+def uncount_cascaded_shows(session, instance):
+    """
+    Takes the shows of a venue or artist being deleted off the counters of its counterparts,
+    since the database deletes them through ON DELETE CASCADE without the flush seeing them
+    """
+    owner_column = Show.venue_id if isinstance(instance, Venue) else Show.artist_id
+    deleted = set((show.venue_id, show.artist_id, show.start_time) for show in session.deleted if isinstance(show, Show))
+    shows = session.query(Show.venue_id, Show.artist_id, Show.start_time).filter(owner_column == instance.id)
+    count_shows(session, [tuple(show) for show in shows if tuple(show) not in deleted], -1)
+
+
+@event.listens_for(db.session, 'before_flush')
+def track_changes(session, flush_context, instances):
+    """
+    Works out which venues and artists a flush affects, before it runs so that the shows of a deleted
+    venue or artist can still be found. Their updated_at is touched, which also covers changes that
+    only concern their genres or shows, the table versions are bumped and their entity cache
+    entries are evicted once the session commits
+    """
+    venue_ids, artist_ids, tables = set(), set(), set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+      if isinstance(instance, Show):
+        venue_ids.update(get_attribute_values(instance, 'venue_id'))
+        artist_ids.update(get_attribute_values(instance, 'artist_id'))
+        tables.add(Show.__tablename__)
+      elif isinstance(instance, VenueGenre):
+        # genre filters and facets make the listing depend on the genres too
+        venue_ids.update(get_attribute_values(instance, 'venue_id'))
+        tables.add(Venue.__tablename__)
+      elif isinstance(instance, ArtistGenre):
+        artist_ids.update(get_attribute_values(instance, 'artist_id'))
+        tables.add(Artist.__tablename__)
+      elif isinstance(instance, (Venue, Artist)):
+        tables.add(instance.__tablename__)
+        if instance.id is None:
+          continue
+        own_ids, counterpart_ids = (venue_ids, artist_ids) if isinstance(instance, Venue) else (artist_ids, venue_ids)
+        own_ids.add(instance.id)
+        if instance in session.deleted:
+          uncount_cascaded_shows(session, instance)
+        if has_counterpart_changes(session, instance):
+          counterpart_ids.update(get_counterpart_ids(session, instance))
+          tables.add(Show.__tablename__)
+    record_changes(session, venue_ids, artist_ids, tables)
+
+
+@event.listens_for(db.session, 'after_flush')
+def count_flushed_shows(session, flush_context):
+    """
+    Counts the shows added and deleted through the unit of work, after the flush so that the ids
+    of shows added through relationships are known
+    """
+    for sign, instances in ((1, session.new), (-1, session.deleted)):
+      count_shows(session, [(show.venue_id, show.artist_id, show.start_time) for show in instances if isinstance(show, Show)], sign)
+
+
+@event.listens_for(db.session, 'after_commit')
+def evict_committed_entities(session):
+    # evicting only once the change is visible keeps other requests from caching the old state again
+    entity_cache.invalidate(*session.info.pop('evicted_entities', ()))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_evicted_entities(session, previous_transaction):
+    session.info.pop('evicted_entities', None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def cache_committed_genres(session):
+    genre_cache.add((genre_id, name) for name, genre_id in session.info.pop('pending_genres', {}).items())
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_pending_genres(session, previous_transaction):
+    session.info.pop('pending_genres', None)
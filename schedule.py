@@ -0,0 +1,84 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import dateutil.parser
+from datetime import datetime
+from itertools import islice
+from dateutil import rrule
+
+#----------------------------------------------------------------------------#
+# Show scheduling.
+#----------------------------------------------------------------------------#
+
+# recurrence frequencies offered by the batch show form and the API
+FREQUENCIES = {'daily': rrule.DAILY, 'weekly': rrule.WEEKLY, 'monthly': rrule.MONTHLY}
+
+
+def expand_recurrence(start, frequency, interval=1, count=None, until=None, max_occurrences=5000):
+  """
+  Lists the start times of a recurring show, e.g. a weekly residency
+
+  Parameters:
+    start (datetime): first occurrence
+    frequency (str): 'daily', 'weekly' or 'monthly'
+    interval (int): number of periods between occurrences, 2 with 'weekly' is every other week
+    count (int): number of occurrences
+    until (datetime): last possible occurrence, used when count is not given
+    max_occurrences (int): largest number of occurrences accepted
+
+  Returns:
+    start_times (list): start times in ascending order
+
+  Raises:
+    ValueError: if the rule is invalid, open-ended or has more than max_occurrences occurrences
+  """
+  if frequency not in FREQUENCIES:
+    raise ValueError('Unknown frequency {!r}'.format(frequency))
+  if not count and until is None:
+    raise ValueError('A recurrence needs a number of occurrences or an end date')
+  if interval < 1 or (count is not None and count < 0):
+    raise ValueError('Interval and number of occurrences must be positive')
+  rule = rrule.rrule(FREQUENCIES[frequency], dtstart=start, interval=interval, count=count or None,\
+                     until=None if count else until)
+  start_times = list(islice(rule, max_occurrences + 1))
+  if len(start_times) > max_occurrences:
+    raise ValueError('A batch is limited to {} shows'.format(max_occurrences))
+  return start_times
+
+
+def parse_start_time(value):
+  """
+  Parses a start time, converting times with a UTC offset to the naive local times stored
+  in the show table
+  """
+  start_time = value if isinstance(value, datetime) else dateutil.parser.parse(str(value))
+  if start_time.tzinfo is not None:
+    start_time = start_time.astimezone().replace(tzinfo=None)
+  return start_time
+
+
+def parse_start_times(values, max_occurrences=5000):
+  """
+  Parses an explicit list of start times
+
+  Raises:
+    ValueError: naming the first value that is not a date and time
+  """
+  values = [value for value in values if str(value).strip()]
+  if len(values) > max_occurrences:
+    raise ValueError('A batch is limited to {} shows'.format(max_occurrences))
+  start_times = []
+  for value in values:
+    try:
+      start_times.append(parse_start_time(value))
+    except (ValueError, OverflowError):
+      raise ValueError('Invalid start time {!r}'.format(value))
+  return start_times
+
+
+def get_show_page_keys(venue_id, artist_id):
+  """
+  Gets the rendered page cache keys that a new show of a venue and artist makes stale
+  """
+  return ['shows', 'venues', 'venue:{}'.format(venue_id), 'artist:{}'.format(artist_id)]
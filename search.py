@@ -0,0 +1,274 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import heapq
+import threading
+import time
+from datetime import timedelta
+from flask import current_app
+from model import db, Venue, Artist, TableVersion
+from text_index import NGramIndex, PrefixIndex, name_indexes, prefix_indexes, index_name
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+# escape character for LIKE patterns, a backslash would need different quoting per database
+LIKE_ESCAPE = '!'
+
+# The in-memory name indexes of text_index are local to the process, like the response and entity
+# caches. They catch up with the writes of other workers and of `flask import-catalog` within
+# SEARCH_INDEX_SYNC_SECONDS, see sync_name_indexes.
+
+# table name -> (monotonic time of the last sync, table version, latest updated_at seen), see
+# sync_name_indexes
+index_syncs = {}
+sync_lock = threading.Lock()
+
+# a write commits some time after setting updated_at, rows changed up to this long before the
+# latest updated_at seen are read again so that a late commit is not missed
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+def escape_like(term):
+  """
+  Escapes LIKE wildcards so that the search term is matched literally
+  """
+  return term.replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)\
+             .replace('%', LIKE_ESCAPE + '%')\
+             .replace('_', LIKE_ESCAPE + '_')
+
+
+def get_rank(name_column, search_term, dialect):
+  """
+  Builds the relevance ordering for name matches
+
+  On PostgreSQL the pg_trgm similarity is used, which is served by the GIN trigram index on the
+  name column. Other databases rank exact matches first, then prefix matches, then shorter names.
+
+  Parameters:
+    name_column (Column): name column being searched
+    search_term (str): term entered by the user
+    dialect (str): name of the database dialect
+
+  Returns:
+    rank (list): order by clauses, most relevant first
+  """
+  if dialect == 'postgresql':
+    return [db.func.similarity(name_column, search_term).desc()]
+  lowered_name = db.func.lower(name_column)
+  lowered_term = search_term.lower()
+  exactness = db.case([(lowered_name == lowered_term, 0),\
+                       (lowered_name.like(escape_like(lowered_term) + '%', escape=LIKE_ESCAPE), 1)],\
+                      else_=2)
+  return [exactness, db.func.length(name_column)]
+
+
+def search_by_name(model, search_term, limit=None):
+  """
+  Implements case-insensitive partial search on the name of venues or artists
+
+  The upcoming show count is read from the upcoming_shows_count column and the total number of
+  matches is returned through a window function, so only the top results are transferred while
+  the count still covers every match.
+
+  When the in-memory name index is enabled (SEARCH_BACKEND = 'memory') the matching ids come from
+  the index and the database is only asked for the upcoming show counts of the top results.
+
+  Parameters:
+    model (Venue|Artist): model to search
+    search_term (str): term entered by the user
+    limit (int): maximum number of results, defaults to SEARCH_RESULT_LIMIT
+
+  Returns:
+    response (dict): total count of matches and data for the top results
+  """
+  limit = limit or current_app.config['SEARCH_RESULT_LIMIT']
+  if current_app.config['SEARCH_BACKEND'] == 'memory':
+    sync_name_indexes(model)
+  index = name_indexes.get(model.__tablename__)
+  if index is not None:
+    return search_in_index(index, model, search_term, limit)
+  results = db.session.query(model.id, model.name,\
+                             model.upcoming_shows_count.label('num_upcoming_shows'),\
+                             db.func.count().over().label('total'))\
+                      .filter(model.name.ilike('%{}%'.format(escape_like(search_term)), escape=LIKE_ESCAPE))\
+                      .order_by(*get_rank(model.name, search_term, db.engine.dialect.name))\
+                      .order_by(model.id)\
+                      .limit(limit)\
+                      .all()
+  return {
+    "count": results[0].total if results else 0,
+    "data": [{"id": result.id,\
+              "name": result.name,\
+              "num_upcoming_shows": result.num_upcoming_shows}\
+              for result in results]
+  }
+
+
+def search_in_index(index, model, search_term, limit):
+  """
+  Answers a name search from the in-memory n-gram index, ranking like the portable fallback of
+  get_rank: exact matches, then prefix matches, then shorter names
+
+  Parameters:
+    index (NGramIndex): name index of the model
+    model (Venue|Artist): model being searched
+    search_term (str): term entered by the user
+    limit (int): maximum number of results
+
+  Returns:
+    response (dict): total count of matches and data for the top results
+  """
+  ids = index.search(search_term)
+  lowered_term = search_term.lower()
+
+  def get_index_rank(doc_id):
+    name = index.get_name(doc_id) or ''
+    return (name != lowered_term, not name.startswith(lowered_term), len(name), doc_id)
+
+  top_ids = heapq.nsmallest(limit, ids, key=get_index_rank)
+  rows = {}
+  if top_ids:
+    rows = {row.id: row for row in db.session.query(model.id, model.name,\
+                                                    model.upcoming_shows_count.label('num_upcoming_shows'))\
+                                             .filter(model.id.in_(top_ids))}
+  return {
+    "count": len(ids),
+    "data": [{"id": rows[doc_id].id,\
+              "name": rows[doc_id].name,\
+              "num_upcoming_shows": rows[doc_id].num_upcoming_shows}\
+              for doc_id in top_ids if doc_id in rows]
+  }
+
+
+def build_name_index(model, index_class=NGramIndex):
+  """
+  Builds an in-memory index over the names of all venues or artists
+
+  Parameters:
+    model (Venue|Artist): model whose names are indexed
+    index_class (class): NGramIndex for search, PrefixIndex for autocomplete
+
+  Returns:
+    index (NGramIndex|PrefixIndex): the populated index
+  """
+  index = index_class()
+  for doc_id, name in db.session.query(model.id, model.name).yield_per(1000):
+    index.add(doc_id, name)
+  return index
+
+
+def get_table_version(table):
+  """
+  Gets the version of a table, bumped by every write to it, see model.bump_table_versions
+  """
+  versions = TableVersion.get_versions([table])
+  return versions[0].version if versions else None
+
+
+def build_name_indexes(model, search_backend):
+  """
+  Builds the in-memory indexes of a model: the autocomplete index always, the n-gram index when
+  search_backend is 'memory'. Records the table version and the latest updated_at for
+  sync_name_indexes
+  """
+  # read first, rows changed while the names are read are synced again
+  version = get_table_version(model.__tablename__)
+  latest = db.session.query(db.func.max(model.updated_at)).scalar()
+  prefix_indexes[model.__tablename__] = build_name_index(model, PrefixIndex)
+  if search_backend == 'memory':
+    name_indexes[model.__tablename__] = build_name_index(model)
+  index_syncs[model.__tablename__] = (time.monotonic(), version, latest)
+
+
+def has_same_ids(model, index):
+  """
+  Tells whether an index holds as many names as the table and the same highest id. A name
+  deleted elsewhere leaves one too many in the index, a name it missed one too few or a
+  different highest id
+  """
+  count, max_id = db.session.query(db.func.count(model.id), db.func.max(model.id)).one()
+  return len(index.names) == count and max(index.names, default=None) == max_id
+
+
+def sync_name_indexes(model):
+  """
+  Builds the in-memory indexes of a model on first use, then brings them up to date with the
+  writes of other processes, at most every SEARCH_INDEX_SYNC_SECONDS. The create, edit and delete
+  paths only update the indexes of the process serving them, so without this the other web
+  workers, and every worker after a `flask import-catalog`, would not find the new names.
+
+  The indexes are not built when the app is imported, which `flask db upgrade` does on databases
+  whose schema is older than the queries below.
+
+  A sync reads the version of the table and stops there when no write was made since the last
+  one. Otherwise the names whose updated_at is past the latest one seen, less SYNC_OVERLAP, are
+  indexed again, and the indexes are rebuilt when they do not hold the ids of the table, which
+  happens when rows were deleted elsewhere. A request finding another one syncing uses the index
+  as it is.
+
+  Parameters:
+    model (Venue|Artist): model whose indexes are synced
+  """
+  table = model.__tablename__
+  last_sync, synced_version, latest = index_syncs.get(table, (None, None, None))
+  if last_sync is not None and time.monotonic() - last_sync < current_app.config['SEARCH_INDEX_SYNC_SECONDS']:
+    return
+  # requests wait for the first build, there is no index to use meanwhile
+  if not sync_lock.acquire(blocking=last_sync is None):
+    return
+  try:
+    if table not in index_syncs:
+      build_name_indexes(model, current_app.config['SEARCH_BACKEND'])
+      return
+    version = get_table_version(table)
+    if version is not None and version == synced_version:
+      index_syncs[table] = (time.monotonic(), version, latest)
+      return
+    changed = db.session.query(model.id, model.name, model.updated_at)
+    if latest is not None:
+      changed = changed.filter(model.updated_at > latest - SYNC_OVERLAP)
+    for doc_id, name, updated_at in changed.yield_per(1000):
+      index_name(table, doc_id, name)
+      latest = updated_at if latest is None else max(latest, updated_at)
+    index_syncs[table] = (time.monotonic(), version, latest)
+    if not all(has_same_ids(model, indexes[table]) for indexes in (name_indexes, prefix_indexes) if table in indexes):
+      build_name_indexes(model, current_app.config['SEARCH_BACKEND'])
+  finally:
+    sync_lock.release()
+
+
+def autocomplete(entity, prefix, limit):
+  """
+  Suggests venues or artists whose name starts with prefix
+
+  Parameters:
+    entity (str): 'venue' or 'artist'
+    prefix (str): beginning of the name typed so far
+    limit (int): maximum number of suggestions
+
+  Returns:
+    suggestions (list): dictionaries with the id and name of each suggestion
+  """
+  if not prefix:
+    return []
+  # a sync may build or rebuild the index, read it afterwards
+  sync_name_indexes(Venue if entity == Venue.__tablename__ else Artist)
+  index = prefix_indexes[entity]
+  return [{"id": doc_id, "name": name} for doc_id, name in index.complete(prefix, limit)]
+
+
+def search_venues(search_term, limit=None):
+  """
+  Searches venues by name, see search_by_name
+  """
+  return search_by_name(Venue, search_term, limit)
+
+
+def search_artists(search_term, limit=None):
+  """
+  Searches artists by name, see search_by_name
+  """
+  return search_by_name(Artist, search_term, limit)
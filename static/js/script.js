@@ -2,3 +2,31 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Fills the datalist of an id input with name suggestions from its data-autocomplete url.
+// Each option carries the id as value and the name as label, so picking a name enters the id.
+window.bindAutocomplete = function bindAutocomplete(input) {
+  var options = document.getElementById(input.getAttribute('list'));
+  var lastQuery = null;
+  input.addEventListener('input', function () {
+    var query = input.value.trim();
+    if (!query || /^\d+$/.test(query) || query === lastQuery) {
+      return;
+    }
+    lastQuery = query;
+    fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(query))
+      .then(function (response) { return response.json(); })
+      .then(function (body) {
+        options.innerHTML = '';
+        body.data.forEach(function (item) {
+          var option = document.createElement('option');
+          option.value = item.id;
+          option.label = item.name;
+          option.textContent = item.name;
+          options.appendChild(option);
+        });
+      });
+  });
+};
+
+document.querySelectorAll('input[data-autocomplete]').forEach(window.bindAutocomplete);
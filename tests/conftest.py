@@ -0,0 +1,61 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config builds the PostgreSQL URL from the environment when it is imported
+os.environ.setdefault('db_port', '5432')
+
+import config
+
+config.SQLALCHEMY_ENGINE_OPTIONS = {}
+config.WTF_CSRF_ENABLED = False
+config.TESTING = True
+
+from app import app as fyyur_app
+from cache import response_cache
+from model import db, entity_cache, genre_cache, Venue, Artist, Show
+import search
+import text_index
+
+
+def clear_caches():
+  response_cache.clear()
+  entity_cache.clear()
+  genre_cache.clear()
+  search.index_syncs.clear()
+  text_index.name_indexes.clear()
+  text_index.prefix_indexes.clear()
+
+
+@pytest.fixture
+def app(tmp_path):
+  """
+  The fyyur app on an empty SQLite database of its own, with the process-wide caches emptied
+  """
+  fyyur_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path / 'fyyur.db')
+  clear_caches()
+  with fyyur_app.app_context():
+    db.create_all()
+    yield fyyur_app
+    db.session.remove()
+  clear_caches()
+
+
+@pytest.fixture
+def catalog(app):
+  """
+  Commits a few venues and artists, each artist playing once at every venue
+  """
+  now = datetime.now()
+  for i in range(4):
+    Venue('Venue {} Hall'.format(i), 'City {}'.format(i % 2), 'CA', '', '', '', '', '', False, '')\
+      .create(['Jazz', 'Rock'] if i % 2 else ['Folk'])
+    Artist('Artist {} Band'.format(i), 'City', 'NY', '', '', '', '', True, '').create(['Jazz'])
+  for venue_id in range(1, 5):
+    for artist_id in range(1, 5):
+      Show(venue_id=venue_id, artist_id=artist_id,\
+           start_time=now + timedelta(days=venue_id * artist_id - 8, hours=artist_id)).create()
+  return app
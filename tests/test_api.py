@@ -0,0 +1,40 @@
+import base64
+
+import pytest
+
+from api import encode_cursor
+
+
+def get_page(app, url, cursor):
+  return app.test_client().get(url, query_string={'cursor': cursor, 'limit': 2})
+
+
+@pytest.mark.parametrize('url', ['/api/v1/venues', '/api/v1/artists', '/api/v1/shows'])
+def test_cursor_pages_through_every_row(catalog, url):
+  client = catalog.test_client()
+  seen, cursor = [], None
+  while True:
+    body = client.get(url, query_string={'cursor': cursor or '', 'limit': 3}).get_json()
+    seen.extend(body['data'])
+    cursor = body['next_cursor']
+    if cursor is None:
+      break
+  assert len(seen) == len(client.get(url, query_string={'limit': 100}).get_json()['data'])
+
+
+@pytest.mark.parametrize('values', [{'id': 1}, [True], [1, 2], ['1'], [None], 7])
+def test_malformed_entity_cursor_is_rejected(catalog, values):
+  assert get_page(catalog, '/api/v1/venues', encode_cursor(values)).status_code == 400
+
+
+@pytest.mark.parametrize('values', [{'start_time': '2020-01-01'}, ['2020-01-01', True, 1],\
+                                    ['2020-01-01', 1], ['2020-01-01', '1', 1], [1, 1, 1],\
+                                    ['not a date', 1, 1]])
+def test_malformed_show_cursor_is_rejected(catalog, values):
+  assert get_page(catalog, '/api/v1/shows', encode_cursor(values)).status_code == 400
+
+
+def test_undecodable_cursor_is_rejected(catalog):
+  cursor = base64.urlsafe_b64encode(b'\xff{').decode()
+  assert get_page(catalog, '/api/v1/venues', cursor).status_code == 400
+  assert get_page(catalog, '/api/v1/venues', 'not base64!').status_code == 400
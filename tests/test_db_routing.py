@@ -0,0 +1,50 @@
+import pytest
+from flask import g, make_response
+
+from db_routing import LAST_WRITE_COOKIE, in_write_window
+
+
+@pytest.fixture
+def replicated(app, monkeypatch):
+  monkeypatch.setitem(app.config, 'DB_REPLICA_BINDS', ['replica_0'])
+  monkeypatch.setitem(app.config, 'DB_READ_YOUR_WRITES_SECONDS', 5)
+  return app
+
+
+def write_cookie(app):
+  with app.test_request_context('/venues/create', method='POST'):
+    response = app.process_response(make_response(''))
+  header = next(value for value in response.headers.getlist('Set-Cookie') if value.startswith(LAST_WRITE_COOKIE + '='))
+  return header.split(';')[0]
+
+
+def read(app, cookie=None):
+  headers = {'Cookie': cookie} if cookie else {}
+  # g lives in the app context, which the app fixture holds open across requests
+  with app.app_context(), app.test_request_context('/venues', headers=headers):
+    app.preprocess_request()
+    return in_write_window(), g.get('db_replica')
+
+
+def test_reads_after_a_write_are_pinned_to_the_primary(replicated):
+  cookie = write_cookie(replicated)
+  assert read(replicated, cookie) == (True, None)
+  assert read(replicated) == (False, 'replica_0')
+
+
+def test_pin_does_not_depend_on_the_secret_key(replicated, monkeypatch):
+  cookie = write_cookie(replicated)
+  # another worker started with a key of its own
+  monkeypatch.setitem(replicated.config, 'SECRET_KEY', b'another worker')
+  assert read(replicated, cookie) == (True, None)
+
+
+def test_expired_or_malformed_pin_is_ignored(replicated, monkeypatch):
+  assert read(replicated, '{}=0'.format(LAST_WRITE_COOKIE)) == (False, 'replica_0')
+  assert read(replicated, '{}=soon'.format(LAST_WRITE_COOKIE)) == (False, 'replica_0')
+
+
+def test_no_pin_without_replicas(app):
+  with app.test_request_context('/venues/create', method='POST'):
+    response = app.process_response(make_response(''))
+  assert not any(value.startswith(LAST_WRITE_COOKIE) for value in response.headers.getlist('Set-Cookie'))
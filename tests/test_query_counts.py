@@ -0,0 +1,26 @@
+from commands import LISTING_PAGES, count_page_statements, add_throwaway_catalog
+from model import db
+
+
+def test_listing_pages_do_not_query_per_row(catalog):
+  before = dict((url, count_page_statements(catalog, url)) for url in LISTING_PAGES)
+  add_throwaway_catalog(25)
+  try:
+    for url in LISTING_PAGES:
+      assert count_page_statements(catalog, url) <= before[url], url
+  finally:
+    db.session.rollback()
+
+
+def test_listing_pages_count_statements_from_a_cold_cache(catalog):
+  for url in LISTING_PAGES:
+    first = count_page_statements(catalog, url)
+    assert first > 0
+    assert count_page_statements(catalog, url) == first, url
+
+
+def test_check_query_counts_command(catalog):
+  result = catalog.test_cli_runner().invoke(args=['check-query-counts', '--size', '10'])
+  assert result.exit_code == 0, result.output
+  for url in LISTING_PAGES:
+    assert url in result.output
@@ -0,0 +1,236 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+#----------------------------------------------------------------------------#
+# N-gram index.
+#----------------------------------------------------------------------------#
+
+class NGramIndex:
+    """
+    In-memory inverted index from character n-grams to the ids of the names containing them.
+    Postings are kept as sorted arrays of 32 bit integers to keep the footprint small.
+
+    Answers the same case-insensitive partial queries as name ILIKE '%term%': candidates are
+    found by intersecting the postings of the term's n-grams and then verified against the name,
+    terms shorter than n fall back to scanning the names.
+    """
+
+    def __init__(self, n=3):
+      self.n = n
+      self.names = {}      # id -> lower cased name
+      self.postings = {}   # n-gram -> array of ids in ascending order
+      self.lock = threading.Lock()
+
+    def get_grams(self, text):
+      """
+      Returns the set of n-grams of a lower cased text
+      """
+      return set(text[i:i + self.n] for i in range(len(text) - self.n + 1))
+
+    def add(self, doc_id, name):
+      """
+      Adds or replaces the name indexed under doc_id
+
+      Parameters:
+        doc_id (int): id of the venue or artist
+        name (str): name to index
+      """
+      with self.lock:
+        self._remove(doc_id)
+        if name is None:
+          return
+        name = name.lower()
+        self.names[doc_id] = name
+        for gram in self.get_grams(name):
+          ids = self.postings.setdefault(gram, array('i'))
+          # ids are mostly handed out in ascending order, so appending is the common case
+          if not ids or ids[-1] < doc_id:
+            ids.append(doc_id)
+          else:
+            ids.insert(bisect_left(ids, doc_id), doc_id)
+
+    def remove(self, doc_id):
+      """
+      Removes doc_id from the index, if present
+      """
+      with self.lock:
+        self._remove(doc_id)
+
+    def _remove(self, doc_id):
+      name = self.names.pop(doc_id, None)
+      if name is None:
+        return
+      for gram in self.get_grams(name):
+        ids = self.postings[gram]
+        position = bisect_left(ids, doc_id)
+        if position < len(ids) and ids[position] == doc_id:
+          del ids[position]
+        if not ids:
+          del self.postings[gram]
+
+    def search(self, term):
+      """
+      Finds the ids whose name contains the term, ignoring case
+
+      Parameters:
+        term (str): partial name to look for
+
+      Returns:
+        ids (list): matching ids in ascending order
+      """
+      term = term.lower()
+      with self.lock:
+        if len(term) < self.n:
+          return sorted(doc_id for doc_id, name in self.names.items() if term in name)
+        postings = []
+        for gram in self.get_grams(term):
+          ids = self.postings.get(gram)
+          if ids is None:
+            return []
+          postings.append(ids)
+        postings.sort(key=len)
+        candidates = postings[0]
+        for ids in postings[1:]:
+          candidates = [doc_id for doc_id in candidates if contains(ids, doc_id)]
+          if not candidates:
+            return []
+        # n-grams may occur in a different order in the name, so confirm the substring
+        return [doc_id for doc_id in candidates if term in self.names[doc_id]]
+
+    def get_name(self, doc_id):
+      """
+      Returns the lower cased name indexed under doc_id
+      """
+      return self.names.get(doc_id)
+
+    def memory_usage(self):
+      """
+      Reports the approximate memory footprint of the index in bytes
+
+      Returns:
+        usage (dict): entry counts and byte sizes of the postings and the names
+      """
+      with self.lock:
+        postings_bytes = sys.getsizeof(self.postings) +\
+                         sum(sys.getsizeof(gram) + sys.getsizeof(ids) for gram, ids in self.postings.items())
+        names_bytes = sys.getsizeof(self.names) +\
+                      sum(sys.getsizeof(doc_id) + sys.getsizeof(name) for doc_id, name in self.names.items())
+        return {
+          'names': len(self.names),
+          'grams': len(self.postings),
+          'postings': sum(len(ids) for ids in self.postings.values()),
+          'postings_bytes': postings_bytes,
+          'names_bytes': names_bytes,
+          'total_bytes': postings_bytes + names_bytes
+        }
+
+
+def contains(ids, doc_id):
+  """
+  Binary search for doc_id in a sorted array of ids
+  """
+  position = bisect_left(ids, doc_id)
+  return position < len(ids) and ids[position] == doc_id
+
+#----------------------------------------------------------------------------#
+# Prefix index.
+#----------------------------------------------------------------------------#
+
+class PrefixIndex:
+    """
+    Sorted array of (lower cased name, id) pairs answering name prefix queries with a binary search.
+    Used for autocomplete, where a query only needs to walk the first few entries after the prefix.
+    """
+
+    def __init__(self):
+      self.keys = []       # (lower cased name, id) in ascending order
+      self.names = {}      # id -> (lower cased name, name as entered)
+      self.lock = threading.Lock()
+
+    def add(self, doc_id, name):
+      """
+      Adds or replaces the name indexed under doc_id
+      """
+      with self.lock:
+        self._remove(doc_id)
+        if name is None:
+          return
+        key = (name.lower(), doc_id)
+        self.keys.insert(bisect_left(self.keys, key), key)
+        self.names[doc_id] = (key[0], name)
+
+    def remove(self, doc_id):
+      """
+      Removes doc_id from the index, if present
+      """
+      with self.lock:
+        self._remove(doc_id)
+
+    def _remove(self, doc_id):
+      entry = self.names.pop(doc_id, None)
+      if entry is None:
+        return
+      key = (entry[0], doc_id)
+      position = bisect_left(self.keys, key)
+      if position < len(self.keys) and self.keys[position] == key:
+        del self.keys[position]
+
+    def complete(self, prefix, limit=10):
+      """
+      Finds the names starting with prefix, ignoring case
+
+      Parameters:
+        prefix (str): beginning of the name typed so far
+        limit (int): maximum number of suggestions
+
+      Returns:
+        suggestions (list): (id, name) pairs in alphabetical order
+      """
+      prefix = prefix.lower()
+      suggestions = []
+      with self.lock:
+        position = bisect_left(self.keys, (prefix,))
+        while position < len(self.keys) and len(suggestions) < limit:
+          name, doc_id = self.keys[position]
+          if not name.startswith(prefix):
+            break
+          suggestions.append((doc_id, self.names[doc_id][1]))
+          position += 1
+      return suggestions
+
+
+#----------------------------------------------------------------------------#
+# Registry.
+#----------------------------------------------------------------------------#
+
+# Name indexes by entity type ('venue', 'artist'), only populated when SEARCH_BACKEND is 'memory'
+name_indexes = {}
+
+# Autocomplete indexes by entity type ('venue', 'artist')
+prefix_indexes = {}
+
+
+def index_name(entity, doc_id, name):
+  """
+  Keeps the name indexes of an entity type in sync after a create or edit
+  """
+  for indexes in (name_indexes, prefix_indexes):
+    index = indexes.get(entity)
+    if index is not None:
+      index.add(doc_id, name)
+
+
+def unindex_name(entity, doc_id):
+  """
+  Keeps the name indexes of an entity type in sync after a delete
+  """
+  for indexes in (name_indexes, prefix_indexes):
+    index = indexes.get(entity)
+    if index is not None:
+      index.remove(doc_id)